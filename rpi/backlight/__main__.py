@@ -1,6 +1,8 @@
 from video_backlight import get_leds as get_video_leds, run as video_run, cleanup as video_cleanup
 from audio_backlight import get_leds as get_audio_leds, run as audio_run
 from backlight_lock import BacklightLock
+from color_transform import check_calibration
+import metrics
 
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from threading import Thread
@@ -22,11 +24,23 @@ class RequestHandler(BaseHTTPRequestHandler):
 
     def do_GET(self):
 
+        if self.path == "/metrics":
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.end_headers()
+            self.wfile.write(metrics.render().encode("utf-8"))
+            return
+
         if self.path == "/brightness":
             body = {
                 "brightness": self.manager.get_brightness()
             }
             self.send_response(200)
+        elif self.path == "/calibration":
+            body = {
+                "calibration": self.manager.get_calibration()
+            }
+            self.send_response(200)
         elif self.path == "/state":
             body = {
                 "state": self.manager.state
@@ -61,6 +75,15 @@ class RequestHandler(BaseHTTPRequestHandler):
 
         if self.path == "/brightness":
             self.manager.set_brightness(message["brightness"])
+        elif self.path == "/calibration":
+            # any of "gamma", "white_balance" and "dither"
+            try:
+                self.manager.set_calibration(message)
+            except ValueError as e:
+                print(f"invalid calibration: {e}")
+                self.send_response(400)
+                self.end_headers()
+                return
         elif self.path == "/state":
             new_state = message["state"]
             if new_state == BacklightManager.STATE_VIDEO:
@@ -91,7 +114,10 @@ class BacklightManager:
 
     def __init__(self):
         self.state = self.STATE_NONE
-        self.brightness = 255
+        # brightness and color calibration set over http, kept across mode
+        # changes; each mode starts from its own config until then
+        self.brightness = None
+        self.calibration = {}
         self.lock = BacklightLock()
 
     def _should_stop(self):
@@ -101,12 +127,12 @@ class BacklightManager:
         while True:
             print(f"state: {self.state}")
             if self.state == self.STATE_VIDEO:
-                video_run(self.lock)
+                video_run(self.lock, self._apply_settings)
                 if self.state == self.STATE_VIDEO:
                     # if no change in state, then we stopped because of an error
                     self.state = self.STATE_ERROR
             elif self.state == self.STATE_AUDIO:
-                audio_run(self.lock)
+                audio_run(self.lock, self._apply_settings)
                 if self.state == self.STATE_AUDIO:
                     # if no change in state, then we stopped because of an error
                     self.state = self.STATE_ERROR
@@ -134,27 +160,54 @@ class BacklightManager:
         else:
             print(f"invalid transition from {self.state} to {state}")
 
-        self.set_brightness(self.brightness)
-
     def set_brightness(self, brightness):
         brightness = int(brightness)
         self.brightness = brightness
-        if self.state == self.STATE_VIDEO:
-            get_video_leds().set_brightness(brightness)
-            return True
-        elif self.state == self.STATE_AUDIO:
-            get_audio_leds().setBrightness(brightness)
-            return True
-        else:
+        leds = self._leds()
+        if leds is None:
             return False
+        leds.set_brightness(brightness)
+        return True
 
     def get_brightness(self):
+        leds = self._leds()
+        return leds.get_brightness() if leds is not None else None
+
+    # raises ValueError, changing nothing, if any value is invalid
+    def set_calibration(self, calibration):
+        if not isinstance(calibration, dict):
+            raise ValueError("calibration must be an object")
+        calibration = {key: calibration[key] for key in ("gamma", "white_balance", "dither") if calibration.get(key) is not None}
+        check_calibration(**calibration)
+        self.calibration.update(calibration)
+        leds = self._leds()
+        if leds is None:
+            return False
+        leds.set_calibration(**self.calibration)
+        return True
+
+    def get_calibration(self):
+        leds = self._leds()
+        return leds.get_calibration() if leds is not None else None
+
+    # Called by a mode with the output it just opened, once get_leds returns
+    # it. Settings stored before this are applied here, later ones by
+    # set_brightness/set_calibration, so none set during a mode change are
+    # lost on the output it's replacing.
+    def _apply_settings(self, leds):
+        if self.brightness is not None:
+            leds.set_brightness(self.brightness)
+        if self.calibration:
+            leds.set_calibration(**self.calibration)
+
+    # the output of the current mode, both have set_brightness/get_brightness
+    # and set_calibration/get_calibration
+    def _leds(self):
         if self.state == self.STATE_VIDEO:
-            return get_video_leds().get_brightness()
+            return get_video_leds()
         elif self.state == self.STATE_AUDIO:
-            return get_audio_leds().getBrightness()
-        else:
-            return None
+            return get_audio_leds()
+        return None
 
 
 def kill_thread(thread):
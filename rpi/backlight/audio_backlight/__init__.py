@@ -1,13 +1,22 @@
-from . import visualization
 from .led import get_leds, init_leds
 
 
-def run(lock):
+def run(lock, on_open=None):
+    """Shows the microphone on the LEDs until `lock` asks for them back
+
+    `on_open` is called with the LED output (see `get_leds`) once it's open,
+    to apply settings kept across mode changes.
+    """
+    # imported here, not with the package, so the hardware free parts
+    # (dsp, melbank, the benchmark) don't need scipy or pyaudio
+    from . import visualization
 
     lock.acquire()
 
     # Initialize LEDs
     init_leds()
+    if on_open is not None:
+        on_open(get_leds())
     visualization.led.update()
     # Start listening to live audio stream
     visualization.microphone.start_stream(lock, visualization.microphone_update)
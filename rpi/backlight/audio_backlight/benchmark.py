@@ -0,0 +1,173 @@
+"""Micro-benchmark for the audio analysis path
+
+Feeds seeded synthetic microphone audio (a few tones plus noise, int16) one
+hop at a time through the rolling window, FFT and mel filterbank stages of
+`visualization.microphone_update`, and reports per stage the time per frame
+and the memory allocated while processing a frame (the tracemalloc peak above
+what was allocated before it, so every temporary counts).
+
+Each in-place stage is run next to a straightforward reference that
+allocates as it goes, and has to agree with it. Only numpy is needed, no
+microphone, LEDs, scipy or pyaudio:
+
+    cd rpi/backlight
+    python3 -m audio_backlight.benchmark
+    python3 -m audio_backlight.benchmark --frames 2000 --json
+    python3 -m audio_backlight.benchmark --mel-bins 12 24 64
+
+The FFT stage (`dsp.RollingFFT`) is checked against windowing, padding and
+transforming a fresh copy of every window; its magnitudes may differ by at
+most `FFT_ERROR_BOUND` relative to the largest one.
+
+The mel projection (`dsp.BandedMatrix`, only the bins under each band) is
+checked against the dense broadcast-multiply-sum over the whole filterbank,
+for every `--mel-bins` band count (default: a range around
+`config.N_FFT_BINS`), within `MEL_ERROR_BOUND` relative to the largest band.
+
+The run exits with status 1 if a check fails.
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+import numpy as np
+from . import config
+from .dsp import RollingFFT, BandedMatrix
+from .microphone import SampleRing
+from . import melbank
+
+# largest difference accepted between the in-place and the reference FFT
+# magnitudes, relative to the largest magnitude (the reference windows in
+# single precision, as microphone_update used to)
+FFT_ERROR_BOUND = 1e-5
+# largest difference accepted between the banded and the dense mel
+# projection, relative to the largest band: float32 tolerance
+MEL_ERROR_BOUND = 1e-6
+# mel band counts benchmarked by default
+MEL_BINS = (12, 24, 48, 96)
+
+
+# int16 hops of tones and noise, from a fixed seed
+def synthetic_hops(frames, hop):
+    rng = np.random.default_rng(0)
+    t = np.arange(frames * hop) / config.MIC_RATE
+    signal = sum(np.sin(2 * np.pi * f * t) for f in (220, 880, 3000)) / 4
+    signal += rng.normal(0, 0.05, len(t))
+    return (np.clip(signal, -1, 1) * 32767).astype(np.int16).reshape(frames, hop)
+
+
+# The FFT stage as it was before RollingFFT: scale, window, pad, transform
+class ReferenceFFT:
+
+    def __init__(self, n):
+        self.window = np.hamming(n)
+
+    def update(self, samples):
+        n = len(samples)
+        y_data = (samples / 2.0**15).astype(np.float32)
+        y_data *= self.window
+        y_padded = np.pad(y_data, (0, 2**int(np.ceil(np.log2(n))) - n), mode='constant')
+        return np.abs(np.fft.rfft(y_padded)[:n // 2])
+
+
+# The mel projection as it was before BandedMatrix: every band times every bin
+def dense_mel(mel_y):
+    return lambda ys: np.sum(np.atleast_2d(ys).T * mel_y.T, axis=0)
+
+
+# largest difference between fn(x) and reference(x) over a sample of xs,
+# relative to the largest reference value
+def max_error(fn, reference, xs):
+    return max(float(np.max(np.abs(fn(x) - reference(x))) / np.max(reference(x)))
+               for x in xs[::max(1, len(xs) // 50)])
+
+
+# seconds and peak bytes allocated per call of fn(window) for every window
+def measure(fn, windows):
+    fn(windows[0])
+    seconds, allocated = [], []
+    tracemalloc.start()
+    try:
+        for window in windows:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            fn(window)
+            allocated.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+    for window in windows:
+        start = time.perf_counter()
+        fn(window)
+        seconds.append(time.perf_counter() - start)
+    return {"mean_us": float(np.mean(seconds)) * 1e6,
+            "p99_us": float(np.percentile(seconds, 99)) * 1e6,
+            "allocated_bytes": float(np.mean(allocated))}
+
+
+def run(frames, mel_bins=MEL_BINS):
+    hop = int(config.MIC_RATE / config.FPS)
+    n = hop * config.N_ROLLING_HISTORY
+    # the rolling windows as microphone.start_stream hands them out
+    ring = SampleRing(n + hop)
+    windows = []
+    for samples in synthetic_hops(frames + config.N_ROLLING_HISTORY - 1, hop):
+        ring.write(samples)
+        if ring.written >= n:
+            windows.append(ring.latest(n, ring.written).copy())
+
+    reference, fft = ReferenceFFT(n), RollingFFT(n)
+    error = max_error(fft.update, reference.update, windows)
+    stages = {
+        "fft reference": measure(reference.update, windows),
+        "fft in place": measure(fft.update, windows),
+    }
+    checks = {
+        "fft": {"error": error, "bound": FFT_ERROR_BOUND, "ok": error <= FFT_ERROR_BOUND},
+    }
+
+    # the spectra microphone_update projects, as in dsp.create_mel_bank
+    spectra = [fft.update(w).copy() for w in windows]
+    for bins in mel_bins:
+        mel_y, _ = melbank.compute_melmat(num_mel_bands=bins,
+                                          freq_min=config.MIN_FREQUENCY,
+                                          freq_max=config.MAX_FREQUENCY,
+                                          num_fft_bands=n // 2,
+                                          sample_rate=config.MIC_RATE)
+        dense, banded = dense_mel(mel_y), BandedMatrix(mel_y)
+        error = max_error(banded.dot, dense, spectra)
+        stages[f"mel dense {bins}"] = measure(dense, spectra)
+        stages[f"mel banded {bins}"] = measure(banded.dot, spectra)
+        checks[f"mel {bins}"] = {"error": error, "bound": MEL_ERROR_BOUND, "ok": error <= MEL_ERROR_BOUND,
+                                 "weights": len(banded.weights), "dense_weights": mel_y.size}
+    return {"frames": len(windows), "window": n, "stages": stages, "checks": checks}
+
+
+def report(result):
+    print(f"{result['frames']} frames, window of {result['window']} samples")
+    print(f"  {'stage':<18} {'mean us':>8} {'p99 us':>8} {'bytes/frame':>12}")
+    for stage, stats in result["stages"].items():
+        print(f"  {stage:<18} {stats['mean_us']:8.1f} {stats['p99_us']:8.1f} {stats['allocated_bytes']:12.0f}")
+    for name, check in result["checks"].items():
+        weights = f", {check['weights']} of {check['dense_weights']} weights" if "weights" in check else ""
+        print(f"{name}: error {check['error']:.2e} (bound {check['bound']:.0e}){weights} {'PASS' if check['ok'] else 'FAIL'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the audio analysis stages and the memory they allocate")
+    parser.add_argument("--frames", type=int, default=600, help="number of hops to process")
+    parser.add_argument("--mel-bins", type=int, nargs="+", default=MEL_BINS, help="mel band counts to benchmark")
+    parser.add_argument("--json", action="store_true", help="print results as json")
+    args = parser.parse_args()
+
+    result = run(args.frames, args.mel_bins)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        report(result)
+    if not all(check["ok"] for check in result["checks"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
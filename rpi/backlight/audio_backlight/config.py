@@ -21,6 +21,13 @@ if DEVICE == 'esp8266':
     """IP address of the ESP8266. Must match IP in ws2812_controller.ino"""
     UDP_PORT = 7777
     """Port number used for socket communication between Python and ESP8266"""
+    UDP_PROTOCOL = 'esp8266'
+    """Protocol spoken by the controller, 'esp8266' or 'ddp'
+
+'esp8266' sends index + rgb of every changed LED, as ws2812_controller.ino
+expects, for at most 256 LEDs. 'ddp' sends the whole strip at once and suits
+DDP controllers such as WLED (set UDP_PORT to 4048) and longer strips.
+"""
     SOFTWARE_GAMMA_CORRECTION = False
     """Set to False because the firmware handles gamma correction + dither"""
 
@@ -54,6 +61,18 @@ N_PIXELS = 100
 GAMMA_TABLE_PATH = os.path.join(os.path.dirname(__file__), 'gamma_table.npy')
 """Location of the gamma correction table"""
 
+WHITE_BALANCE = (1.0, 1.0, 1.0)
+"""Gains between 0 and 1 applied to red, green and blue to make white look white"""
+
+SOFTWARE_DITHER = False
+"""Whether to temporally dither the corrected colors
+
+Recovers levels lost to gamma correction and low brightness by alternating
+the LEDs between the two nearest levels from frame to frame. Only useful
+with SOFTWARE_GAMMA_CORRECTION or a low brightness on a device without
+hardware dithering.
+"""
+
 MIC_RATE = 44100
 """Sampling frequency of the microphone in Hz"""
 
@@ -25,6 +25,91 @@ class ExpFilter:
         return self.value
 
 
+_FFT_OUT = np.lib.NumpyVersion(np.__version__) >= '2.0.0'
+"""Whether np.fft takes an `out` array (numpy 2.0 on)"""
+
+
+def aligned_zeros(n, dtype, alignment=64):
+    """Zeroed 1d array whose data starts on an `alignment` byte boundary"""
+    dtype = np.dtype(dtype)
+    raw = np.zeros(n * dtype.itemsize + alignment, dtype=np.uint8)
+    offset = -raw.ctypes.data % alignment
+    return raw[offset:offset + n * dtype.itemsize].view(dtype)
+
+
+class RollingFFT:
+    """Magnitude spectrum of a rolling window of int16 samples
+
+    Nothing is allocated per frame (with numpy 2, older versions allocate the
+    complex spectrum): the samples are weighted by a Hamming window with the
+    int16 to [-1, 1] scaling folded into its coefficients, in place in a
+    preallocated, aligned buffer zero padded to a power of two, which is
+    transformed into a preallocated spectrum. Double precision, as single
+    precision transforms allocate a working copy on every call.
+
+    Parameters
+    ----------
+    n : int
+        Samples in the window.
+    """
+    def __init__(self, n):
+        self.n = n
+        self.coefficients = np.hamming(n) / 2.0**15
+        padded = 2**int(np.ceil(np.log2(n)))
+        self.input = aligned_zeros(padded, np.float64)
+        self.spectrum = aligned_zeros(padded // 2 + 1, np.complex128)
+        self.magnitudes = np.zeros(n // 2)
+
+    def update(self, samples):
+        """Returns the magnitudes of the first n // 2 bins for `samples`
+
+        The returned array is overwritten by the next update.
+        """
+        window = self.input[:self.n]
+        # cast first, multiplying int16 by float64 would go through a buffer
+        np.copyto(window, samples)
+        window *= self.coefficients
+        if _FFT_OUT:
+            spectrum = np.fft.rfft(self.input, out=self.spectrum)
+        else:
+            spectrum = np.fft.rfft(self.input)
+        return np.abs(spectrum[:self.n // 2], out=self.magnitudes)
+
+
+class BandedMatrix:
+    """Matrix whose rows are each zero outside one run of columns
+
+    Like the triangular filters of a mel filterbank, each covering a narrow
+    band of FFT bins. Only the runs are kept, back to back: the column
+    indices and weights of every row's run and where each run starts. The
+    product with a vector gathers just those columns, weights them and sums
+    each run with one np.add.reduceat, into preallocated buffers.
+
+    Parameters
+    ----------
+    matrix : ndarray
+        Dense (rows, columns) matrix.
+    """
+    def __init__(self, matrix):
+        nonzero = matrix != 0
+        first = np.argmax(nonzero, axis=1)
+        last = matrix.shape[1] - np.argmax(nonzero[:, ::-1], axis=1)
+        # an all zero row keeps one zero weight, reduceat can't sum nothing
+        lengths = np.where(nonzero.any(axis=1), last - first, 1)
+        self.shape = matrix.shape
+        self.offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        self.index = np.concatenate([np.arange(f, f + n) for f, n in zip(first, lengths)])
+        self.weights = matrix[np.repeat(np.arange(len(matrix)), lengths), self.index]
+        self.products = np.zeros(len(self.index))
+        self.out = np.zeros(len(matrix))
+
+    def dot(self, vector):
+        """Returns matrix @ vector, overwritten by the next call"""
+        vector.take(self.index, out=self.products, mode='clip')
+        self.products *= self.weights
+        return np.add.reduceat(self.products, self.offsets, out=self.out)
+
+
 def rfft(data, window=None):
     window = 1.0 if window is None else window(len(data))
     ys = np.abs(np.fft.rfft(data * window))
@@ -40,14 +125,17 @@ def fft(data, window=None):
 
 
 def create_mel_bank():
-    global samples, mel_y, mel_x
+    global samples, mel_y, mel_x, mel_bands
     samples = int(config.MIC_RATE * config.N_ROLLING_HISTORY / (2.0 * config.FPS))
     mel_y, (_, mel_x) = melbank.compute_melmat(num_mel_bands=config.N_FFT_BINS,
                                                freq_min=config.MIN_FREQUENCY,
                                                freq_max=config.MAX_FREQUENCY,
                                                num_fft_bands=samples,
                                                sample_rate=config.MIC_RATE)
+    mel_bands = BandedMatrix(mel_y)
 samples = None
 mel_y = None
 mel_x = None
+mel_bands = None
+"""mel_y as a BandedMatrix, for projecting spectra onto the mel bands"""
 create_mel_bank()
\ No newline at end of file
@@ -1,139 +1,79 @@
 from __future__ import print_function
 from __future__ import division
 
-import platform
 import numpy as np
+from strips import open_strips
+from color_transform import ColorTransform
 from . import config
 
-def init_leds():
-    global strip
-    from rpi_ws281x import PixelStrip, Color
-    strip = PixelStrip(config.N_PIXELS, config.LED_PIN,
-                                       config.LED_FREQ_HZ, config.LED_DMA,
-                                       config.LED_INVERT, config.BRIGHTNESS)
-    strip.begin()
+output = None
+"""strips.StripManager the LED strip is driven through, shared with video mode"""
 
-init_leds()
+def _strip_spec():
+    if config.DEVICE == 'pi':
+        return {"type": "pwm", "count": config.N_PIXELS, "pin": config.LED_PIN}
+    elif config.DEVICE == 'esp8266':
+        return {"type": "udp", "count": config.N_PIXELS, "host": config.UDP_IP, "port": config.UDP_PORT,
+                "protocol": config.UDP_PROTOCOL}
+    elif config.DEVICE == 'blinkstick':
+        return {"type": "blinkstick", "count": config.N_PIXELS}
+    else:
+        raise ValueError('Invalid device selected')
 
-_gamma = np.load(config.GAMMA_TABLE_PATH)
-"""Gamma lookup table used for nonlinear brightness correction"""
+def _transform():
+    """Color correction per config: gamma table, white balance and dither"""
+    gamma = np.load(config.GAMMA_TABLE_PATH) if config.SOFTWARE_GAMMA_CORRECTION else 1.0
+    return ColorTransform(gamma, config.WHITE_BALANCE, dither=config.SOFTWARE_DITHER)
 
-_prev_pixels = np.tile(253, (3, config.N_PIXELS))
-"""Pixel values that were most recently displayed on the LED strip"""
+def init_leds():
+    """Opens (or reopens) the LED output for config.DEVICE
+
+    Called by `run`, not on import, so the package can be imported on a
+    machine without the LED hardware or its libraries.
+    """
+    global output
+    if output is not None:
+        output.cleanup()
+    if config.DEVICE == 'pi':
+        output = open_strips([_strip_spec()], config.LED_DMA, config.LED_FREQ_HZ,
+                             config.BRIGHTNESS, config.LED_INVERT, _transform())
+    else:
+        output = open_strips([_strip_spec()], transform=_transform())
+    output.begin()
 
 pixels = np.tile(1, (3, config.N_PIXELS))
 """Pixel values for the LED strip"""
 
-_is_python_2 = int(platform.python_version_tuple()[0]) == 2
-
-def _update_esp8266():
-    """Sends UDP packets to ESP8266 to update LED strip values
+_frame = np.zeros((config.N_PIXELS, 3), dtype=np.uint8)
+"""Pixel values as handed to the output, one rgb row per pixel"""
 
-    The ESP8266 will receive and decode the packets to determine what values
-    to display on the LED strip. The communication protocol supports LED strips
-    with a maximum of 256 LEDs.
+_clipped = np.zeros((config.N_PIXELS, 3))
+_levels = np.zeros((config.N_PIXELS, 3), dtype=np.intp)
+"""Preallocated buffers for `update`, in the layout of `_frame`"""
 
-    The packet encoding scheme is:
-        |i|r|g|b|
-    where
-        i (0 to 255): Index of LED to change (zero-based)
-        r (0 to 255): Red value of LED
-        g (0 to 255): Green value of LED
-        b (0 to 255): Blue value of LED
-    """
-    global pixels, _prev_pixels
-    # Truncate values and cast to integer
-    pixels = np.clip(pixels, 0, 255).astype(int)
-    # Optionally apply gamma correc tio
-    p = _gamma[pixels] if config.SOFTWARE_GAMMA_CORRECTION else np.copy(pixels)
-    MAX_PIXELS_PER_PACKET = 126
-    # Pixel indices
-    idx = range(pixels.shape[1])
-    idx = [i for i in idx if not np.array_equal(p[:, i], _prev_pixels[:, i])]
-    n_packets = len(idx) // MAX_PIXELS_PER_PACKET + 1
-    idx = np.array_split(idx, n_packets)
-    for packet_indices in idx:
-        m = '' if _is_python_2 else []
-        for i in packet_indices:
-            if _is_python_2:
-                m += chr(i) + chr(p[0][i]) + chr(p[1][i]) + chr(p[2][i])
-            else:
-                m.append(i)  # Index of pixel to change
-                m.append(p[0][i])  # Pixel red value
-                m.append(p[1][i])  # Pixel green value
-                m.append(p[2][i])  # Pixel blue value
-        m = m if _is_python_2 else bytes(m)
-        _sock.sendto(m, (config.UDP_IP, config.UDP_PORT))
-    _prev_pixels = np.copy(p)
-
-
-def _update_pi():
-    """Writes new LED values to the Raspberry Pi's LED strip
-
-    Raspberry Pi uses the rpi_ws281x to control the LED strip directly.
-    This function updates the LED strip with new values.
-    """
-    global pixels, _prev_pixels
-    # Truncate values and cast to integer
-    pixels = np.clip(pixels, 0, 255).astype(int)
-    # Optional gamma correction
-    p = _gamma[pixels] if config.SOFTWARE_GAMMA_CORRECTION else np.copy(pixels)
-    # Encode 24-bit LED values in 32 bit integers
-    r = np.left_shift(p[0][:].astype(int), 8)
-    g = np.left_shift(p[1][:].astype(int), 16)
-    b = p[2][:].astype(int)
-    rgb = np.bitwise_or(np.bitwise_or(r, g), b)
-    # Update the pixels
-    for i in range(config.N_PIXELS):
-        # Ignore pixels if they haven't changed (saves bandwidth)
-        if np.array_equal(p[:, i], _prev_pixels[:, i]):
-            continue
-        #strip._led_data[i] = rgb[i]
-        strip._led_data[i] = int(rgb[i])
-    _prev_pixels = np.copy(p)
-    strip.show()
 
 def get_leds():
-    global strip
-    return strip
+    """The LED output, None until `init_leds` opened it"""
+    global output
+    return output
+
 
-def _update_blinkstick():
-    """Writes new LED values to the Blinkstick.
-        This function updates the LED strip with new values.
+def update():
+    """Updates the LED strip values
+
+    The output applies gamma correction, white balance and the brightness
+    set through `get_leds().set_brightness` in one table lookup, and only
+    writes the pixels that changed since the last update. Nothing is
+    allocated per call: the pixels are clipped and truncated to integers
+    into preallocated buffers.
     """
     global pixels
-    
     # Truncate values and cast to integer
-    pixels = np.clip(pixels, 0, 255).astype(int)
-    # Optional gamma correction
-    p = _gamma[pixels] if config.SOFTWARE_GAMMA_CORRECTION else np.copy(pixels)
-    # Read the rgb values
-    r = p[0][:].astype(int)
-    g = p[1][:].astype(int)
-    b = p[2][:].astype(int)
-
-    #create array in which we will store the led states
-    newstrip = [None]*(config.N_PIXELS*3)
-
-    for i in range(config.N_PIXELS):
-        # blinkstick uses GRB format
-        newstrip[i*3] = g[i]
-        newstrip[i*3+1] = r[i]
-        newstrip[i*3+2] = b[i]
-    #send the data to the blinkstick
-    stick.set_led_data(0, newstrip)
-
-
-def update():
-    """Updates the LED strip values"""
-    if config.DEVICE == 'esp8266':
-        _update_esp8266()
-    elif config.DEVICE == 'pi':
-        _update_pi()
-    elif config.DEVICE == 'blinkstick':
-        _update_blinkstick()
-    else:
-        raise ValueError('Invalid device selected')
+    np.clip(np.transpose(pixels), 0, 255, out=_clipped)
+    np.copyto(_levels, _clipped, casting='unsafe')
+    np.copyto(_frame, _levels, casting='unsafe')
+    pixels = _levels.T
+    output.write(_frame)
 
 
 # Execute this file to run a LED strand test
@@ -141,6 +81,7 @@ def update():
 # across the LED strip continously
 if __name__ == '__main__':
     import time
+    init_leds()
     # Turn all pixels off
     pixels *= 0
     pixels[0, 0] = 255  # Set 1st pixel red
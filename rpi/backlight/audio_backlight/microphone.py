@@ -1,30 +1,110 @@
-import time
+import threading
 import numpy as np
-import pyaudio
+import metrics
 from . import config
 
 
+RING_SLACK_HOPS = 4
+"""Hops of audio the ring holds past the rolling window
+
+Room for the stream to keep writing while a hop is processed, without
+overwriting samples still being looked at.
+"""
+
+overruns = metrics.counter('backlight_audio_input_overruns_total',
+                           'Times the audio input reported samples lost before they reached the ring')
+underruns = metrics.counter('backlight_audio_input_underruns_total',
+                            'Times the audio input reported a gap, or no hop arrived in time')
+hops_dropped = metrics.counter('backlight_audio_hops_dropped_total',
+                               'Hops of audio skipped because processing fell behind')
+
+
+class SampleRing:
+    """Fixed size ring of int16 samples, written by the stream callback
+
+    Every sample is stored twice, once in each half of the buffer, so the
+    latest n samples (n up to the capacity) are always one contiguous view,
+    however the writes wrapped around.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = np.zeros(2 * capacity, dtype=np.int16)
+        self.written = 0
+        """Samples written since the start, the end of the latest window"""
+        self.ready = threading.Condition()
+
+    def write(self, samples):
+        samples = samples[-self.capacity:]
+        start = self.written % self.capacity
+        first = min(len(samples), self.capacity - start)
+        for offset in (0, self.capacity):
+            self.buffer[offset + start:offset + start + first] = samples[:first]
+            self.buffer[offset:offset + len(samples) - first] = samples[first:]
+        with self.ready:
+            self.written += len(samples)
+            self.ready.notify()
+
+    def wait(self, written, timeout):
+        """Waits until `written` samples are in, returns the count so far"""
+        with self.ready:
+            self.ready.wait_for(lambda: self.written >= written, timeout)
+            return self.written
+
+    def latest(self, n, end):
+        """View of the n samples before sample number `end`, no copy
+
+        Only valid until the stream writes over them, about the ring's slack
+        after `end`.
+        """
+        stop = self.capacity + end % self.capacity
+        return self.buffer[stop - n:stop]
+
+
 def start_stream(lock, callback):
+    """Streams the microphone to `callback` one hop at a time
+
+    The stream runs in callback mode and writes straight into a SampleRing;
+    this thread waits for each hop and passes `callback` a view of the
+    rolling window ending with it, the last config.N_ROLLING_HISTORY hops of
+    int16 samples. When processing falls behind by more than a hop, the hops
+    in between are skipped (and counted) so the output stays live.
+    """
+    # imported here so SampleRing can be used without an audio device
+    import pyaudio
+
+    hop = int(config.MIC_RATE / config.FPS)
+    window = hop * config.N_ROLLING_HISTORY
+    ring = SampleRing(window + hop * RING_SLACK_HOPS)
+
+    def on_audio(in_data, frame_count, time_info, status):
+        if status & pyaudio.paInputOverflow:
+            overruns.inc()
+        if status & pyaudio.paInputUnderflow:
+            underruns.inc()
+        ring.write(np.frombuffer(in_data, dtype=np.int16))
+        return None, pyaudio.paContinue
+
     p = pyaudio.PyAudio()
-    frames_per_buffer = int(config.MIC_RATE / config.FPS)
     stream = p.open(format=pyaudio.paInt16,
                     channels=1,
                     rate=config.MIC_RATE,
                     input=True,
-                    frames_per_buffer=frames_per_buffer)
-    overflows = 0
-    prev_ovf_time = time.time()
+                    frames_per_buffer=hop,
+                    stream_callback=on_audio)
+    stream.start_stream()
+    end = hop
     while not lock.should_release():
-        try:
-            y = np.fromstring(stream.read(frames_per_buffer, exception_on_overflow=False), dtype=np.int16)
-            y = y.astype(np.float32)
-            stream.read(stream.get_read_available(), exception_on_overflow=False)
-            callback(y)
-        except IOError:
-            overflows += 1
-            if time.time() > prev_ovf_time + 1:
-                prev_ovf_time = time.time()
-                print('Audio buffer has overflowed {} times'.format(overflows))
+        written = ring.wait(end, 2 * hop / config.MIC_RATE)
+        if written < end:
+            underruns.inc()
+            continue
+        behind = (written - end) // hop
+        if behind:
+            hops_dropped.inc(behind)
+            end += behind * hop
+        callback(ring.latest(window, end))
+        end += hop
 
     print("Cleaning up audio")
     stream.stop_stream()
@@ -3,6 +3,7 @@ from __future__ import division
 import time
 import numpy as np
 from scipy.ndimage.filters import gaussian_filter1d
+import metrics
 from . import config
 from . import microphone
 from . import dsp
@@ -184,46 +185,50 @@ mel_smoothing = dsp.ExpFilter(np.tile(1e-1, config.N_FFT_BINS),
                          alpha_decay=0.5, alpha_rise=0.99)
 volume = dsp.ExpFilter(config.MIN_VOLUME_THRESHOLD,
                        alpha_decay=0.02, alpha_rise=0.02)
-fft_window = np.hamming(int(config.MIC_RATE / config.FPS) * config.N_ROLLING_HISTORY)
+rolling_fft = dsp.RollingFFT(int(config.MIC_RATE / config.FPS) * config.N_ROLLING_HISTORY)
+"""Windowed, zero padded FFT of the rolling window, computed in place"""
 prev_fps_update = time.time()
 
+fft_seconds = metrics.histogram('backlight_audio_fft_seconds', 'Time spent windowing and transforming audio')
+mel_seconds = metrics.histogram('backlight_audio_mel_seconds', 'Time spent on the mel filterbank and gain normalization')
+effect_seconds = metrics.histogram('backlight_audio_effect_seconds', 'Time spent in the visualization effect')
+led_io_seconds = metrics.histogram('backlight_audio_led_io_seconds', 'Time spent writing pixels to the leds')
+fps_gauge = metrics.gauge('backlight_audio_fps', 'Estimated audio visualization frames per second')
+
 
 def microphone_update(audio_samples):
-    global y_roll, prev_rms, prev_exp, prev_fps_update
-    # Normalize samples between 0 and 1
-    y = audio_samples / 2.0**15
-    # Construct a rolling window of audio samples
-    y_roll[:-1] = y_roll[1:]
-    y_roll[-1, :] = np.copy(y)
-    y_data = np.concatenate(y_roll, axis=0).astype(np.float32)
-    
-    vol = np.max(np.abs(y_data))
+    """Visualizes the rolling window of int16 samples from the microphone"""
+    global prev_rms, prev_exp, prev_fps_update
+    # Peak volume between 0 and 1, without an abs() copy of the window
+    vol = max(int(audio_samples.max()), -int(audio_samples.min())) / 2.0**15
     if vol < config.MIN_VOLUME_THRESHOLD:
         print('No audio input. Volume below threshold. Volume:', vol)
         led.pixels = np.tile(0, (3, config.N_PIXELS))
         led.update()
     else:
         # Transform audio input into the frequency domain
-        N = len(y_data)
-        N_zeros = 2**int(np.ceil(np.log2(N))) - N
-        # Pad with zeros until the next power of two
-        y_data *= fft_window
-        y_padded = np.pad(y_data, (0, N_zeros), mode='constant')
-        YS = np.abs(np.fft.rfft(y_padded)[:N // 2])
+        start = time.perf_counter()
+        YS = rolling_fft.update(audio_samples)
+        fft_seconds.observe(time.perf_counter() - start)
         # Construct a Mel filterbank from the FFT data
-        mel = np.atleast_2d(YS).T * dsp.mel_y.T
+        start = time.perf_counter()
+        # Only the bins under each band, the filters are mostly zeros
+        mel = dsp.mel_bands.dot(YS)
         # Scale data to values more suitable for visualization
-        # mel = np.sum(mel, axis=0)
-        mel = np.sum(mel, axis=0)
         mel = mel**2.0
         # Gain normalization
         mel_gain.update(np.max(gaussian_filter1d(mel, sigma=1.0)))
         mel /= mel_gain.value
         mel = mel_smoothing.update(mel)
+        mel_seconds.observe(time.perf_counter() - start)
         # Map filterbank output onto LED strip
+        start = time.perf_counter()
         output = visualization_effect(mel)
+        effect_seconds.observe(time.perf_counter() - start)
         led.pixels = output
+        start = time.perf_counter()
         led.update()
+        led_io_seconds.observe(time.perf_counter() - start)
         if config.USE_GUI:
             # Plot filterbank output
             x = np.linspace(config.MIN_FREQUENCY, config.MAX_FREQUENCY, len(mel))
@@ -235,19 +240,14 @@ def microphone_update(audio_samples):
     if config.USE_GUI:
         app.processEvents()
     
+    fps = frames_per_second()
+    fps_gauge.set(fps)
     if config.DISPLAY_FPS:
-        fps = frames_per_second()
         if time.time() - 0.5 > prev_fps_update:
             prev_fps_update = time.time()
             print('FPS {:.0f} / {:.0f}'.format(fps, config.FPS))
 
 
-# Number of audio samples to read every time frame
-samples_per_frame = int(config.MIC_RATE / config.FPS)
-
-# Array containing the rolling audio sample window
-y_roll = np.random.rand(config.N_ROLLING_HISTORY, samples_per_frame) / 1e16
-
 visualization_effect = visualize_spectrum
 """Visualization effect to display on the LED strip"""
 
@@ -0,0 +1,120 @@
+import numpy as np
+
+
+# The color correction of the led output layer, shared by the video and
+# audio modes through their StripManager.
+#
+# Gamma, per channel white balance gains and brightness are folded into one
+# 256 entry table per channel, rebuilt only when one of them changes, so a
+# frame is corrected with a single take into a preallocated buffer: the
+# three tables sit one after another and each channel's levels are offset to
+# its own table first.
+#
+# Optionally the correction is temporally dithered: the tables are also kept
+# in 8.8 fixed point and what's lost rounding a led down to 8 bits is carried
+# over to its next frame, so at low brightness a level between two steps is
+# shown by alternating between them. That only works as long as frames keep
+# coming; a frame that's written again unchanged is still dithered, one that
+# isn't written at all leaves the leds where they were.
+
+# each channel's table starts this far into the combined one
+CHANNEL_OFFSETS = np.array([0, 256, 512], dtype=np.intp)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, (bool, np.bool_))
+
+
+# Checks calibration values (None for any left as they are) and returns them
+# normalized, raising ValueError for anything ColorTransform can't use:
+# gamma a positive exponent or 256 levels 0-255, white_balance three gains
+# 0-1, dither a bool. They may come straight from json.
+def check_calibration(gamma=None, white_balance=None, dither=None):
+    if gamma is not None:
+        if _is_number(gamma):
+            if not 0 < gamma < float("inf"):
+                raise ValueError(f"gamma must be a positive number, not {gamma}")
+            gamma = float(gamma)
+        else:
+            if not isinstance(gamma, (list, tuple, np.ndarray)) or len(gamma) != 256 or \
+                    not all(_is_number(level) for level in gamma):
+                raise ValueError("gamma must be a positive number or a table of 256 levels")
+            gamma = np.array(gamma, dtype=float)
+            if not ((gamma >= 0) & (gamma <= 255)).all():
+                raise ValueError("gamma table levels must be between 0 and 255")
+    if white_balance is not None:
+        if not isinstance(white_balance, (list, tuple, np.ndarray)) or len(white_balance) != 3 or \
+                not all(_is_number(gain) and 0 <= gain <= 1 for gain in white_balance):
+            raise ValueError(f"white_balance must be three gains between 0 and 1, not {white_balance!r}")
+        white_balance = tuple(float(gain) for gain in white_balance)
+    if dither is not None and not isinstance(dither, (bool, np.bool_)):
+        raise ValueError(f"dither must be true or false, not {dither!r}")
+    return gamma, white_balance, dither
+
+
+class ColorTransform:
+
+    # gamma: exponent applied to levels in 0-1 (1 for none), or a 256 entry
+    # table of corrected levels 0-255. white_balance: gains for r, g, b
+    def __init__(self, gamma=1.0, white_balance=(1.0, 1.0, 1.0), brightness=255, dither=False):
+        self.gamma, self.white_balance, dither = check_calibration(gamma, white_balance, dither)
+        self.brightness = brightness
+        self.dither = bool(dither)
+        # per frame buffers, sized on the first frame
+        self.index = None
+        self.level = None
+        self.residual = None
+        self._build()
+
+    def set_brightness(self, brightness):
+        self.brightness = brightness
+        self._build()
+
+    # None leaves a setting as it is; invalid values (see check_calibration)
+    # raise ValueError and change nothing
+    def set_calibration(self, gamma=None, white_balance=None, dither=None):
+        gamma, white_balance, dither = check_calibration(gamma, white_balance, dither)
+        if gamma is not None:
+            self.gamma = gamma
+        if white_balance is not None:
+            self.white_balance = white_balance
+        if dither is not None:
+            self.dither = bool(dither)
+            self.residual = None
+        self._build()
+
+    def calibration(self):
+        gamma = self.gamma if np.ndim(self.gamma) == 0 else "table"
+        return {"gamma": gamma, "white_balance": list(self.white_balance), "dither": self.dither}
+
+    def _build(self):
+        if np.ndim(self.gamma) == 0:
+            curve = (np.arange(256) / 255) ** self.gamma
+        else:
+            curve = np.asarray(self.gamma, dtype=float) / 255
+        gains = np.array(self.white_balance)[:, None] * (self.brightness / 255)
+        # 8.8 fixed point, at most 255.0
+        fine = np.clip(np.round(curve * gains * 255 * 256), 0, 255 * 256)
+        self.fine = fine.astype(np.uint32).reshape(-1)
+        self.lut = ((self.fine + 128) >> 8).astype(np.uint8)
+
+    # frame: (N, 3) uint8 rgb, corrected into out, another (N, 3) uint8
+    def apply(self, frame, out):
+        if self.index is None or len(self.index) != len(frame):
+            self.index = np.zeros(frame.shape, dtype=np.intp)
+            self.level = np.zeros(frame.shape, dtype=np.uint32)
+            self.residual = None
+        np.add(frame, CHANNEL_OFFSETS, out=self.index)
+        if not self.dither:
+            # the method and mode="clip" skip np.take's dispatch and bounds
+            # checking buffer, the offsets keep every index in range
+            self.lut.take(self.index, out=out, mode="clip")
+            return
+        if self.residual is None:
+            self.residual = np.zeros(frame.shape, dtype=np.uint32)
+        level = self.level
+        self.fine.take(self.index, out=level, mode="clip")
+        level += self.residual
+        np.bitwise_and(level, 0xff, out=self.residual)
+        level >>= 8
+        np.copyto(out, level, casting="unsafe")
@@ -0,0 +1,114 @@
+from bisect import bisect_left
+from threading import Lock
+
+
+# Tiny metrics registry for the live box, rendered in the Prometheus text
+# format by the http server (GET /metrics). Updates are plain attribute
+# arithmetic with no locking, cheap enough to do several times per frame;
+# under the GIL the worst case is a scrape seeing one histogram mid-update.
+
+# upper bounds (seconds) of the latency histogram buckets, +Inf is implicit
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help, fn=None):
+        self.name = name
+        self.help = help
+        self.value = 0
+        # optional callable giving the current value at scrape time
+        self.fn = fn
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def render(self):
+        value = self.fn() if self.fn is not None else self.value
+        return [f"{self.name} {value}"]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # one count per bucket plus the +Inf overflow, non-cumulative
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {cumulative + self.counts[-1]}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.lock = Lock()
+        self.metrics = {}
+
+    def _register(self, cls, name, *args, **kwargs):
+        # registering the same name again returns the existing metric, so
+        # modules can declare what they use without coordinating
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, help, fn=None):
+        return self._register(Counter, name, help, fn)
+
+    def gauge(self, name, help, fn=None):
+        return self._register(Gauge, name, help, fn)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, help, buckets)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+def counter(name, help, fn=None):
+    return registry.counter(name, help, fn)
+
+def gauge(name, help, fn=None):
+    return registry.gauge(name, help, fn)
+
+def histogram(name, help, buckets=LATENCY_BUCKETS):
+    return registry.histogram(name, help, buckets)
+
+def render():
+    return registry.render()
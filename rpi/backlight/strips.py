@@ -0,0 +1,469 @@
+import ctypes
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from color_transform import ColorTransform
+
+
+# The led output layer shared by the video and audio modes.
+#
+# A StripManager owns any number of output devices and drives their strips
+# as one logical strip, the strips one after another in the order they're
+# listed. `write` takes a whole frame, (N, 3) uint8 rgb, one row per led,
+# and does what every backend needs in one place, into preallocated
+# buffers: color correction (a ColorTransform: gamma, white balance and
+# brightness), packing to 0xRRGGBB ints (like rpi_ws281x.Color) and finding
+# the leds that changed since the last frame. Devices whose leds
+# changed then get their part of the frame, all at once, so a frame takes as
+# long as the slowest device, not their sum.
+#
+# A device's `write(frame, packed, changed)` gets views of its own leds: the
+# rgb rows, the packed values and the changed mask, and pushes them out:
+#   WS281xDevice     rpi_ws281x, PWM channel 0 and/or 1, or SPI
+#   UDPDevice        a network controller, esp8266 |i|r|g|b| or DDP protocol
+#   BlinkstickDevice a BlinkStick Pro
+#   FakeDevice       in process, keeps what it's shown and can take as long
+#                    as a real strip of its length would
+
+WS281X_FREQ_HZ = 800000  # led signal frequency in hertz (usually 800khz)
+WS281X_DMA = 10          # DMA channel used to generate the signal
+# a ws281x strip takes 30us per led plus a 50us reset to refresh
+WS281X_LED_SECONDS = 30e-6
+WS281X_RESET_SECONDS = 50e-6
+# most leds in one esp8266 packet, as the esp8266 firmware expects
+UDP_MAX_LEDS_PER_PACKET = 126
+# one led of an esp8266 packet
+ESP8266_LED = np.dtype([("index", np.uint8), ("rgb", np.uint8, (3,))])
+# DDP (Distributed Display Protocol, as spoken by e.g. WLED): a 10 byte header
+# then rgb data. Flags (version 1, push on the last packet of a frame), a 4
+# bit sequence number, data type (rgb, 8 bits each), destination (display),
+# byte offset of the data in the frame and its length, both big endian
+DDP_PORT = 4048
+DDP_VERSION_1 = 0x40
+DDP_PUSH = 0x01
+DDP_TYPE_RGB24 = 0x0b
+DDP_ID_DISPLAY = 1
+DDP_HEADER = np.dtype([("flags", np.uint8), ("sequence", np.uint8), ("type", np.uint8), ("id", np.uint8),
+                       ("offset", ">u4"), ("length", ">u2")])
+# most leds per DDP packet, so a packet stays within an ethernet frame
+DDP_MAX_LEDS_PER_PACKET = 480
+
+
+# fastest a ws281x strip of this many leds can be refreshed
+def max_fps(count):
+    return int(((count * WS281X_LED_SECONDS) + WS281X_RESET_SECONDS) ** -1.0)
+
+
+# One rpi_ws281x handle, driving one strip per channel: PWM channels 0 and 1
+# have to share a handle (and so render together), a strip on SPI (gpio 10)
+# gets one to itself. `strips` is a list of (gpio, count, channel); this is
+# what rpi_ws281x.PixelStrip does for a single channel.
+#
+# Once initialised, each channel's led buffer (uint32 0xRRGGBB, which the
+# driver reorders for the strip on render) is viewed as a numpy array, so
+# changed leds are written in one masked copy instead of a call per led.
+class WS281xDevice:
+
+    def __init__(self, strips, dma=WS281X_DMA, freq=WS281X_FREQ_HZ, invert=False):
+        from rpi_ws281x import ws
+        self.ws = ws
+        self.counts = [count for _, count, _ in strips]
+        self.handle = ws.new_ws2811_t()
+        for number in range(2):
+            channel = ws.ws2811_channel_get(self.handle, number)
+            ws.ws2811_channel_t_count_set(channel, 0)
+            ws.ws2811_channel_t_gpionum_set(channel, 0)
+            ws.ws2811_channel_t_invert_set(channel, 0)
+            ws.ws2811_channel_t_brightness_set(channel, 0)
+        self.channels = []
+        for gpio, count, number in strips:
+            channel = ws.ws2811_channel_get(self.handle, number)
+            ws.ws2811_channel_t_count_set(channel, count)
+            ws.ws2811_channel_t_gpionum_set(channel, gpio)
+            ws.ws2811_channel_t_invert_set(channel, 1 if invert else 0)
+            # brightness is up to the StripManager
+            ws.ws2811_channel_t_brightness_set(channel, 255)
+            ws.ws2811_channel_t_strip_type_set(channel, ws.WS2811_STRIP_GRB)
+            self.channels.append(channel)
+        ws.ws2811_t_freq_set(self.handle, freq)
+        ws.ws2811_t_dmanum_set(self.handle, dma)
+        self.leds = None
+
+    def begin(self):
+        resp = self.ws.ws2811_init(self.handle)
+        if resp != 0:
+            raise RuntimeError(f"ws2811_init failed with code {resp} ({self.ws.ws2811_get_return_t_str(resp)})")
+        try:
+            # the buffers are allocated by ws2811_init and freed by ws2811_fini
+            self.leds = [np.ctypeslib.as_array((ctypes.c_uint32 * count).from_address(int(self.ws.ws2811_channel_t_leds_get(channel))))
+                         for channel, count in zip(self.channels, self.counts)]
+        except TypeError:
+            # bindings whose pointers don't convert to an address
+            self.leds = None
+
+    def write(self, frame, packed, changed):
+        start = 0
+        for number, (channel, count) in enumerate(zip(self.channels, self.counts)):
+            end = start + count
+            if self.leds is not None:
+                np.copyto(self.leds[number], packed[start:end], where=changed[start:end])
+            else:
+                indices = np.flatnonzero(changed[start:end])
+                for i, value in zip(indices.tolist(), packed[start + indices].tolist()):
+                    self.ws.ws2811_led_set(channel, i, value)
+            start = end
+        resp = self.ws.ws2811_render(self.handle)
+        if resp != 0:
+            raise RuntimeError(f"ws2811_render failed with code {resp} ({self.ws.ws2811_get_return_t_str(resp)})")
+
+    def cleanup(self):
+        if self.handle is not None:
+            self.leds = None
+            self.ws.ws2811_fini(self.handle)
+            self.ws.delete_ws2811_t(self.handle)
+            self.handle = None
+            self.channels = []
+
+
+# One strip behind a network controller. The "esp8266" protocol sends
+# |i|r|g|b| for every changed led, at most UDP_MAX_LEDS_PER_PACKET per
+# datagram, so at most 256 leds. "ddp" sends the whole frame every time
+# anything changed, in one datagram up to DDP_MAX_LEDS_PER_PACKET leds, with
+# a sequence number; any number of leds. Packets are built in preallocated
+# buffers, straight from the changed mask.
+class UDPDevice:
+
+    def __init__(self, count, host, port=None, protocol="esp8266"):
+        self.counts = [count]
+        self.protocol = protocol
+        if protocol == "esp8266":
+            if count > 256:
+                raise ValueError(f"the esp8266 protocol addresses at most 256 leds, not {count}, use ddp")
+            self.leds = np.zeros(count, dtype=ESP8266_LED)
+        elif protocol == "ddp":
+            packets = -(-count // DDP_MAX_LEDS_PER_PACKET)
+            self.headers = np.zeros(packets, dtype=DDP_HEADER)
+            self.headers["flags"] = DDP_VERSION_1
+            self.headers["flags"][-1] |= DDP_PUSH
+            self.headers["type"] = DDP_TYPE_RGB24
+            self.headers["id"] = DDP_ID_DISPLAY
+            starts = np.arange(packets) * DDP_MAX_LEDS_PER_PACKET
+            self.headers["offset"] = starts * 3
+            self.headers["length"] = (np.minimum(starts + DDP_MAX_LEDS_PER_PACKET, count) - starts) * 3
+            # header + data of each packet
+            self.packets = [np.empty(DDP_HEADER.itemsize + int(length), dtype=np.uint8) for length in self.headers["length"]]
+            self.sequence = 0
+        else:
+            raise ValueError(f"Invalid udp protocol: {protocol}")
+        self.address = (host, port or (DDP_PORT if protocol == "ddp" else 7777))
+        self.sock = None
+
+    def begin(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def write(self, frame, packed, changed):
+        if self.protocol == "esp8266":
+            indices = np.flatnonzero(changed)
+            leds = self.leds[:len(indices)]
+            leds["index"] = indices
+            leds["rgb"] = frame[indices]
+            for start in range(0, len(leds), UDP_MAX_LEDS_PER_PACKET):
+                self.sock.sendto(leds[start:start + UDP_MAX_LEDS_PER_PACKET], self.address)
+            return
+        # sequence numbers run 1-15, 0 means none
+        self.sequence = self.sequence % 15 + 1
+        self.headers["sequence"] = self.sequence
+        data = frame.reshape(-1)
+        for n, packet in enumerate(self.packets):
+            packet[:DDP_HEADER.itemsize] = self.headers[n:n + 1].view(np.uint8)
+            offset = int(self.headers["offset"][n])
+            packet[DDP_HEADER.itemsize:] = data[offset:offset + len(packet) - DDP_HEADER.itemsize]
+            self.sock.sendto(packet, self.address)
+
+    def cleanup(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+# Stand-in for a network controller on a local socket, to check what a
+# UDPDevice sends: decodes either protocol into `frame` (rgb rows, like a
+# StripManager frame before brightness), counting packets, bytes and whole
+# frames. DDP frames are complete on the push flag; out of order sequence
+# numbers are counted.
+class UDPReceiver:
+
+    def __init__(self, count, protocol="esp8266", host="127.0.0.1"):
+        self.protocol = protocol
+        self.frame = np.zeros((count, 3), dtype=np.uint8)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, 0))
+        self.sock.settimeout(1)
+        self.address = self.sock.getsockname()
+        self.buffer = bytearray(65536)
+        self.packets = 0
+        self.bytes = 0
+        self.frames = 0
+        self.sequence = 0
+        self.out_of_order = 0
+
+    # handles one datagram, returns False if none came in time
+    def receive(self):
+        try:
+            size = self.sock.recv_into(self.buffer)
+        except socket.timeout:
+            return False
+        self.packets += 1
+        self.bytes += size
+        data = np.frombuffer(self.buffer, dtype=np.uint8, count=size)
+        if self.protocol == "esp8266":
+            leds = data.view(ESP8266_LED)
+            self.frame[leds["index"]] = leds["rgb"]
+            return True
+        header = data[:DDP_HEADER.itemsize].view(DDP_HEADER)[0]
+        offset, length = int(header["offset"]), int(header["length"])
+        self.frame.reshape(-1)[offset:offset + length] = data[DDP_HEADER.itemsize:DDP_HEADER.itemsize + length]
+        if header["flags"] & DDP_PUSH:
+            self.frames += 1
+            if self.sequence and header["sequence"] != self.sequence % 15 + 1:
+                self.out_of_order += 1
+            self.sequence = int(header["sequence"])
+        return True
+
+    def close(self):
+        self.sock.close()
+
+
+# A BlinkStick Pro on usb, which takes the whole strip as a list of grb bytes.
+class BlinkstickDevice:
+
+    def __init__(self, count):
+        self.counts = [count]
+        self.grb = np.empty((count, 3), dtype=np.uint8)
+        self.stick = None
+
+    def begin(self):
+        from blinkstick import blinkstick
+        self.stick = blinkstick.find_first()
+        if self.stick is None:
+            raise RuntimeError("no BlinkStick found")
+
+    def write(self, frame, packed, changed):
+        self.grb[:, 0] = frame[:, 1]
+        self.grb[:, 1] = frame[:, 0]
+        self.grb[:, 2] = frame[:, 2]
+        self.stick.set_led_data(0, self.grb.ravel().tolist())
+
+    def cleanup(self):
+        self.stick = None
+
+
+# Stands in for real strips: accepts everything, drives nothing. `shown` is
+# what the last write would have put on the leds (rgb), `frames` every frame
+# written if `record` is set; with `wire_time` a write blocks as long as a
+# ws281x strip of that length takes to refresh.
+class FakeDevice:
+
+    def __init__(self, counts, wire_time=False, record=False):
+        self.counts = list(counts)
+        self.shown = np.zeros((sum(self.counts), 3), dtype=np.uint8)
+        self.frames = [] if record else None
+        self.writes = 0
+        self.seconds = max(self.counts) * WS281X_LED_SECONDS + WS281X_RESET_SECONDS if wire_time else 0
+
+    def begin(self):
+        pass
+
+    def write(self, frame, packed, changed):
+        if self.seconds:
+            time.sleep(self.seconds)
+        np.copyto(self.shown, frame)
+        if self.frames is not None:
+            self.frames.append(frame.copy())
+        self.writes += 1
+
+    def cleanup(self):
+        pass
+
+
+class StripManager:
+
+    def __init__(self, devices, brightness=255, transform=None):
+        self.devices = devices
+        self.transform = transform or ColorTransform()
+        counts = [sum(device.counts) for device in devices]
+        self.starts = np.cumsum([0] + counts).tolist()
+        self.count = self.starts[-1]
+        # the last frame written, before and after color correction
+        self.source = np.zeros((self.count, 3), dtype=np.uint8)
+        self.frame = np.zeros((self.count, 3), dtype=np.uint8)
+        self.packed = np.zeros(self.count, dtype=np.uint32)
+        self.scratch = np.zeros(self.count, dtype=np.uint32)
+        self.written = np.zeros(self.count, dtype=np.uint32)
+        self.changed = np.ones(self.count, dtype=bool)
+        self.set_brightness(brightness)
+        # writes to all but the first device, which the caller does itself
+        self.pool = ThreadPoolExecutor(len(devices) - 1) if len(devices) > 1 else None
+        self.fresh = True
+        # calibration changes rewrite the last frame from the http thread
+        self.lock = threading.Lock()
+
+    def begin(self):
+        for device in self.devices:
+            device.begin()
+        # whatever the strips hold now, the first frame goes out in full
+        self.fresh = True
+
+    # frame: (count, 3) uint8 rgb, one row per led in logical order.
+    # Returns whether anything had to be written
+    def write(self, frame):
+        with self.lock:
+            return self._write_frame(frame)
+
+    def _write_frame(self, frame):
+        if frame is not self.source:
+            np.copyto(self.source, frame)
+        self.transform.apply(frame, self.frame)
+        frame, packed, scratch = self.frame, self.packed, self.scratch
+        np.left_shift(frame[:, 0], 16, out=packed, dtype=np.uint32)
+        np.left_shift(frame[:, 1], 8, out=scratch, dtype=np.uint32)
+        packed |= scratch
+        packed |= frame[:, 2]
+
+        if self.fresh:
+            self.changed.fill(True)
+            self.fresh = False
+        else:
+            np.not_equal(packed, self.written, out=self.changed)
+        writes = [(device, start, end) for device, start, end in zip(self.devices, self.starts, self.starts[1:])
+                  if self.changed[start:end].any()]
+        if not writes:
+            return False
+        np.copyto(self.written, packed)
+
+        pending = [self.pool.submit(self._write, *write) for write in writes[1:]] if len(writes) > 1 else []
+        self._write(*writes[0])
+        for future in pending:
+            future.result()
+        return True
+
+    def _write(self, device, start, end):
+        device.write(self.frame[start:end], self.packed[start:end], self.changed[start:end])
+
+    # 0-255, applied in software the same way for every device
+    def set_brightness(self, brightness):
+        self.transform.set_brightness(brightness)
+        # every led has to be rewritten at the new brightness
+        self.fresh = True
+
+    def get_brightness(self):
+        return self.transform.brightness
+
+    # see ColorTransform.set_calibration; the last frame is shown again with
+    # the new calibration right away, callers only look at brightness
+    def set_calibration(self, gamma=None, white_balance=None, dither=None):
+        with self.lock:
+            self.transform.set_calibration(gamma, white_balance, dither)
+            self.fresh = True
+            self._write_frame(self.source)
+
+    def get_calibration(self):
+        return self.transform.calibration()
+
+    def cleanup(self):
+        for device in self.devices:
+            device.cleanup()
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
+# Builds the devices for strip specs, dicts in logical order, each with a
+# "count" and a "type":
+#   "pwm"   rpi_ws281x on "pin" (18/12 are channel 0, 13/19 channel 1)
+#   "spi"   rpi_ws281x on SPI, gpio 10
+#   "udp"   network controller at "host", optional "port" and "protocol"
+#           ("esp8266", the default, or "ddp")
+#   "blinkstick" a BlinkStick Pro
+#   "fake"  a FakeDevice, "wire_time" and "record" optional
+# Strips on both PWM channels share one device; they must be listed next to
+# each other, since a device's strips are contiguous in the logical strip.
+# Colors are corrected by `transform` (a ColorTransform), none by default.
+def open_strips(specs, dma=WS281X_DMA, freq=WS281X_FREQ_HZ, brightness=255, invert=False, transform=None):
+    devices = []
+    pwm = None
+    for spec in specs:
+        kind, count = spec["type"], spec["count"]
+        if kind == "pwm":
+            channel = 1 if spec["pin"] in (13, 19, 41, 45, 53) else 0
+            if pwm is not None and devices[-1] is pwm and len(pwm) == 1 and pwm[0][2] != channel:
+                pwm.append((spec["pin"], count, channel))
+                continue
+            if pwm is not None:
+                raise ValueError("at most one strip per PWM channel, listed next to each other")
+            pwm = [(spec["pin"], count, channel)]
+            devices.append(pwm)
+        elif kind == "spi":
+            devices.append(WS281xDevice([(10, count, 0)], dma, freq, invert))
+        elif kind == "udp":
+            devices.append(UDPDevice(count, spec["host"], spec.get("port"), spec.get("protocol", "esp8266")))
+        elif kind == "blinkstick":
+            devices.append(BlinkstickDevice(count))
+        elif kind == "fake":
+            devices.append(FakeDevice([count], spec.get("wire_time", False), spec.get("record", False)))
+        else:
+            raise ValueError(f"Invalid strip type: {kind}")
+    devices = [WS281xDevice(device, dma, freq, invert) if device is pwm else device for device in devices]
+    return StripManager(devices, brightness, transform)
+
+
+# Sends random frames through a UDPDevice to a local UDPReceiver, checks the
+# receiver ends up with every frame as sent and reports what it cost on the
+# wire: python3 strips.py --protocol ddp --leds 300
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="check a udp protocol against a local receiver")
+    parser.add_argument("--protocol", choices=["esp8266", "ddp"], default="esp8266")
+    parser.add_argument("--leds", type=int, default=100)
+    parser.add_argument("--frames", type=int, default=1000)
+    parser.add_argument("--changed", type=float, default=0.5, help="fraction of leds changed per frame")
+    args = parser.parse_args()
+
+    receiver = UDPReceiver(args.leds, args.protocol)
+    device = UDPDevice(args.leds, *receiver.address, args.protocol)
+    strips = StripManager([device])
+    strips.begin()
+    rng = np.random.default_rng(0)
+    frame = np.zeros((args.leds, 3), dtype=np.uint8)
+    mismatches = 0
+    seconds = 0
+    for _ in range(args.frames):
+        changed = rng.random(args.leds) < args.changed
+        frame[changed] = rng.integers(0, 256, (int(changed.sum()), 3), dtype=np.uint8)
+        packets = receiver.packets
+        start = time.perf_counter()
+        written = strips.write(frame)
+        seconds += time.perf_counter() - start
+        # loopback doesn't drop or reorder, so everything sent is waiting
+        if not written:
+            expected = 0
+        elif args.protocol == "ddp":
+            expected = -(-args.leds // DDP_MAX_LEDS_PER_PACKET)
+        else:
+            expected = -(-np.count_nonzero(strips.changed) // UDP_MAX_LEDS_PER_PACKET)
+        while receiver.packets - packets < expected and receiver.receive():
+            pass
+        mismatches += not np.array_equal(receiver.frame, frame)
+    strips.cleanup()
+    receiver.close()
+
+    ok = mismatches == 0 and receiver.out_of_order == 0
+    print(f"{args.protocol}: {args.frames} frames of {args.leds} leds, {args.changed:.0%} changed")
+    print(f"  {receiver.packets / seconds:.0f} packets/s sent, {receiver.packets / args.frames:.2f} packets/frame, "
+          f"{receiver.bytes / args.frames:.0f} bytes/frame, {seconds / args.frames * 1e6:.1f} us/frame")
+    print(f"  {mismatches} frames wrong, {receiver.out_of_order} out of order")
+    print("PASS" if ok else "FAIL")
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,116 @@
+import time
+import numpy as np
+from .bounds import BoundsDetector
+from .static import ChangeDetector
+from .smoothing import ColorSmoother
+from .scenecut import SceneCutDetector
+from . import yuv
+
+
+# The per-frame analysis of the video mode: static check, letterbox bounds
+# and color sampling, producing the colors to show (or None when the leds
+# don't need touching). Shared by `run` and the replay benchmark so both
+# measure exactly the same path.
+#
+# `configure` applies a quality level (see governor.py): frames between
+# analyzed ones, and static frames, only step the smoother towards the last
+# sampled colors until it has settled.
+#
+# `smoothing` is the smoothing window used even at full quality. A hard cut
+# (see scenecut.py) resets the smoother, so the colors jump straight to the
+# new scene however heavy the smoothing is; `cut` tells whoever eases the
+# output after this to do the same.
+#
+# With a yuv.YUVSampler the frames are packed YUYV: letterbox bounds are
+# found on the luma channel alone and cropped on macropixel boundaries.
+class FrameAnalyzer:
+
+    # stages timed on every frame, named after their `counters` entries
+    STAGES = ("static check", "bounds", "processing mean")
+
+    def __init__(self, sampler, smoothing=1, cut_threshold=None):
+        self.sampler = sampler
+        self.yuyv = isinstance(sampler, yuv.YUVSampler)
+        self.detector = BoundsDetector(sampler.black_threshold) if self.yuyv else BoundsDetector()
+        self.change = ChangeDetector()
+        self.smoothing = smoothing
+        self.smoother = ColorSmoother(smoothing)
+        self.scenecut = SceneCutDetector(cut_threshold)
+        # what scene changes are scored on, the sampled colors unless the
+        # sampler keeps steadier ones (see DominantSampler), and the last ones
+        self.scene_colors = None
+        # scene change score of the last frame if it was sampled, else None
+        self.score = None
+        self.cut = False
+        # analyze every cadence'th frame
+        self.cadence = 1
+        self.frames = 0
+        # last colors (and brightness) sent to the leds, to skip identical writes
+        self.shown_colors = None
+        self.shown_brightness = None
+        # seconds spent in each stage on the last frame
+        self.timings = dict.fromkeys(self.STAGES, 0)
+        # counter name of the reason the last frame was skipped, if it was
+        self.skipped = None
+
+    def configure(self, stride, cadence, window):
+        self.sampler.set_stride(stride)
+        self.cadence = cadence
+        self.smoother.set_window(max(window, self.smoothing))
+
+    # returns the rgb colors to show, or None if the leds are already up to date
+    def analyze(self, frame, brightness):
+        timings = self.timings
+        for stage in self.STAGES:
+            timings[stage] = 0
+
+        smoother = self.smoother
+        self.score = None
+        self.cut = False
+        idle = smoother.settled and brightness == self.shown_brightness
+        self.frames += 1
+        if self.cadence > 1 and self.frames % self.cadence and smoother.target is not None:
+            # between analyzed frames
+            if idle:
+                self.skipped = "cadence skipped"
+                return None
+            colors = smoother.step()
+        else:
+            # nothing moved: skip analysis entirely, unless the brightness needs applying
+            start = time.perf_counter()
+            changed = self.change.changed(frame)
+            timings["static check"] = time.perf_counter() - start
+            if not changed and smoother.target is not None:
+                if idle:
+                    self.skipped = "static frames"
+                    return None
+                colors = smoother.step()
+            else:
+                start = time.perf_counter()
+                if self.yuyv:
+                    frame = yuv.apply_bounds(frame, self.detector.update(frame[:, :, :1]))
+                else:
+                    frame = self.detector.apply(frame)
+                timings["bounds"] = time.perf_counter() - start
+
+                start = time.perf_counter()
+                sampled = self.sampler.means(frame)
+                timings["processing mean"] = time.perf_counter() - start
+
+                scene = getattr(self.sampler, "scene_colors", sampled)
+                self.cut = self.scenecut.update(self.scene_colors if smoother.target is not None else None, scene)
+                self.scene_colors = scene.astype(np.float32)
+                self.score = self.scenecut.score
+                if self.cut:
+                    smoother.reset()
+                colors = smoother.update(sampled)
+
+        # the picture changed but the colors didn't, don't bother the leds
+        if self.shown_colors is not None and brightness == self.shown_brightness and np.array_equal(colors, self.shown_colors):
+            self.skipped = "led writes skipped"
+            return None
+        self.shown_colors = colors.copy()
+        self.shown_brightness = brightness
+
+        self.skipped = None
+        return colors[:, ::-1] # bgr to rgb
@@ -0,0 +1,648 @@
+"""Replay benchmark for the video pipeline
+
+Feeds frames from a video file, an .npy frame stack or a synthetic generator
+through the same analysis path as `hdmi_backlight.run` (static check, bounds,
+sampling) and into `DMALeds` backed by a fake strip, then reports p50/p95/p99
+per stage and the overall throughput. Needs nothing but numpy (and cv2 for
+video files), so it runs on any Linux box:
+
+    cd rpi/backlight
+    python3 -m video_backlight.benchmark --synthetic letterbox
+    python3 -m video_backlight.benchmark --npy frames.npy --sampling edges
+    python3 -m video_backlight.benchmark --video clip.mp4 --frames 2000
+    python3 -m video_backlight.benchmark --level 2
+    python3 -m video_backlight.benchmark --target-fps 200
+    python3 -m video_backlight.benchmark --yuyv
+    python3 -m video_backlight.benchmark --workers 3
+    python3 -m video_backlight.benchmark --sampling dominant
+    python3 -m video_backlight.benchmark --smoothing 1 --cut-threshold 0.1
+    python3 -m video_backlight.benchmark --roi --workers 1
+    python3 -m video_backlight.benchmark --check decimation --check yuyv
+    python3 -m video_backlight.benchmark --check all
+
+`--level` replays at a fixed quality level, `--target-fps` lets the quality
+governor pick levels as in `run`.
+
+`--workers` runs the analysis in that many processes fed through the shared
+memory ring (`workers.AnalysisPool`), as `ANALYSIS_WORKERS` does in `run`.
+Every report includes how many cores were busy on average (process and
+worker cpu time over wall time, from /proc).
+
+`--yuyv` encodes the frames to YUYV (bt601, limited range, like a capture
+card would send them) and replays them through the `yuv.YUVSampler` path.
+
+`--smoothing` and `--cut-threshold` default to `SMOOTHING_WINDOW` and the
+sampling mode's `SCENE_CUT_THRESHOLD` of `hdmi_backlight`; every report gives
+the scene change score percentiles of the sampled frames and how many of them
+were cuts, to tune the threshold against real footage. (The synthetic
+"motion" frames are unrelated pictures, every one of them a cut.)
+
+`--roi` reads the frames through `roi.ROICapture` as `CAPTURE_ROI` does,
+cropping to the letterbox bounds as views (the replay can't crop in a
+driver); tracking the bounds counts towards "read frame".
+
+A plain run only replays and times. `--check` (repeatable, or `all`) adds
+self-checks, and the run exits with status 1 if one of those fails:
+
+  decimation     how far the colors sampled at each level's row stride are
+                 from the full resolution ones, worst case and 99th
+                 percentile over the frames. On `--npy` and `--video`
+                 footage that is only reported: `DECIMATION_ERROR_BOUND`
+                 holds per horizontal edge crossing a zone, and fine
+                 horizontal detail can be off by far more, so the
+                 measurement is what tells how a stride does on that kind
+                 of content. The synthetic frames are large blocks with a
+                 few edges per zone, within the bound by construction;
+                 there exceeding it fails, which only guards the strided
+                 sampling against regressions. Not with `--sampling
+                 dominant`.
+  yuyv           the colors sampled from the YUYV encoding of the frames
+                 against decoding them to bgr first and sampling that,
+                 which is what the bgr capture path does; they may differ
+                 by at most `YUV_ERROR_BOUND`. Not with `--sampling
+                 dominant`.
+  dominant-cost  the dominant color sampler timed against the zone averager
+                 on the same frames, within `DOMINANT_COST_BOUND` times its
+                 cost.
+  scene-cuts     the cut threshold on smooth pictures panning with a cut
+                 every `SCENE_LENGTH` frames, from `SCENE_SEEDS` seeds: at
+                 least `SCENE_CUT_RECALL` of the cuts have to be found, and
+                 no pan frame may be taken for a cut.
+  strips         frames shown on fake strips that take as long as real ones
+                 (`strips.FakeDevice`), split over two of them; flushing
+                 them at once may cost at most `STRIP_FLUSH_BOUND` times the
+                 longest strip.
+  v4l2           streams through `v4l2capture.V4L2Capture` with a fake
+                 driver behind its system calls (`v4l2capture.FakeDriver`),
+                 full frame, cropped with `set_crop` and back, and once with
+                 a driver that scales the crop back up: every frame has to
+                 have the negotiated shape and the driver's pixels, and
+                 every frame the driver captured has to be counted as
+                 consumed or dropped. Running `video_backlight/v4l2capture.py`
+                 checks a real device.
+
+Synthetic frames are generated from a fixed seed, so runs are comparable
+across commits on the same machine.
+"""
+import argparse
+import json
+import sys
+import os
+import time
+from itertools import islice
+from types import SimpleNamespace
+import numpy as np
+from .leds import DMALeds, LED_COUNT
+from .analysis import FrameAnalyzer
+from .hdmi_backlight import open_sampler, SMOOTHING_WINDOW, SCENE_CUT_THRESHOLD
+from .governor import QualityGovernor, LEVELS, DECIMATION_ERROR_BOUND
+from . import yuv
+from .workers import AnalysisPool, PoolOutput, SLOT_BYTES
+from .roi import ROICapture
+from .v4l2capture import V4L2Capture, FakeDriver, check_capture
+from strips import StripManager, FakeDevice, max_fps
+
+# largest per-channel difference accepted between sampling YUYV directly and
+# sampling the decoded bgr frame: the Y/U/V means are floored (half a level,
+# times up to ~2 for blue from Cb), and both sides round to whole levels
+YUV_ERROR_BOUND = 4
+# most the dominant color mode may cost, relative to the zone means
+DOMINANT_COST_BOUND = 2
+# most showing the leds split over several strips may take, relative to
+# refreshing the longest of them alone
+STRIP_FLUSH_BOUND = 1.5
+# frames per scene of the scene cut check, seeds of its pictures, and the
+# fraction of its cuts that have to be found (none of the pans may cut)
+SCENE_LENGTH = 30
+SCENE_SEEDS = 4
+SCENE_CUT_RECALL = 0.9
+
+SYNTHETIC = ("letterbox", "static", "motion")
+# self-checks `--check` can add to a run, see above
+CHECKS = ("decimation", "yuyv", "dominant-cost", "scene-cuts", "strips", "v4l2")
+# the checks that sample means, which dominant sampling doesn't
+MEAN_CHECKS = ("decimation", "yuyv")
+
+
+# leds on an in-process fake strip: accepts everything, drives nothing
+def null_leds():
+    return DMALeds(StripManager([FakeDevice([LED_COUNT])]))
+
+
+# Hands out replayed frames the way a capture does, for ROICapture
+class ReplayCapture:
+
+    def __init__(self, frames):
+        self.frames = iter(frames)
+
+    def read(self, timeout=3):
+        frame = next(self.frames, None)
+        return frame is not None, frame
+
+    def set_crop(self, rect):
+        return False
+
+def roi_frames(frames, threshold, yuyv=False):
+    cap = ROICapture(ReplayCapture(frames), threshold, yuyv)
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            return
+        yield frame
+
+def synthetic_frames(kind, count, width=1920, height=1080, seed=0, yuyv=False):
+    rng = np.random.default_rng(seed)
+    # a handful of distinct frames, cycled, so generation isn't what gets measured
+    pool = []
+    for _ in range(1 if kind == "static" else 8):
+        # blocky random picture so zones get distinct colors that change every frame
+        blocks = rng.integers(0, 256, (9, 16, 3), dtype=np.uint8)
+        picture = np.repeat(np.repeat(blocks, -(-height // 9), axis=0), -(-width // 16), axis=1)[:height, :width]
+        if kind == "letterbox":
+            # 2.39:1 picture with black bars above and below
+            bar = (height - int(width / 2.39)) // 2
+            picture[:bar] = 0
+            picture[height - bar:] = 0
+        pool.append(yuv.bgr_to_yuyv(picture) if yuyv else np.ascontiguousarray(picture))
+    return (pool[i % len(pool)] for i in range(count))
+
+# Smooth pictures (a coarse random grid, bilinearly upscaled) each panning
+# across half their width over `length` frames, then cut to the next one
+def scene_frames(scenes, length=SCENE_LENGTH, width=960, height=540, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = np.linspace(0, 5, height)
+    cols = np.linspace(0, 19, 2 * width)
+    r0 = np.minimum(rows.astype(int), 4)
+    c0 = np.minimum(cols.astype(int), 18)
+    fy = (rows - r0)[:, None, None]
+    fx = (cols - c0)[None, :, None]
+    for _ in range(scenes):
+        grid = rng.integers(0, 256, (6, 20, 3)).astype(np.float32)
+        top = grid[r0][:, c0] * (1 - fx) + grid[r0][:, c0 + 1] * fx
+        bottom = grid[r0 + 1][:, c0] * (1 - fx) + grid[r0 + 1][:, c0 + 1] * fx
+        picture = (top * (1 - fy) + bottom * fy).astype(np.uint8)
+        for i in range(length):
+            offset = i * width // (2 * length)
+            yield np.ascontiguousarray(picture[:, offset:offset + width])
+
+def npy_frames(path, count=None):
+    frames = np.load(path, mmap_mode="r")
+    if frames.ndim == 3:
+        frames = frames[np.newaxis]
+    count = count or len(frames)
+    for i in range(count):
+        yield frames[i % len(frames)]
+
+def video_frames(path, count=None):
+    import cv2
+    cap = cv2.VideoCapture(path)
+    read = 0
+    while count is None or read < count:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        read += 1
+        yield frame
+    cap.release()
+
+
+def percentiles(samples):
+    samples = np.asarray(samples)
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {"p50": p50, "p95": p95, "p99": p99, "mean": samples.mean()}
+
+def cpu_seconds(pids):
+    # user + system time of each process, all threads included
+    ticks = 0
+    for pid in pids:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        ticks += int(fields[11]) + int(fields[12])
+    return ticks / os.sysconf("SC_CLK_TCK")
+
+# cut_threshold: "sampling" for the sampling mode's SCENE_CUT_THRESHOLD
+def replay(frames, sampling="zones", level=0, target_fps=None, yuyv=False, workers=0,
+           smoothing=SMOOTHING_WINDOW, cut_threshold="sampling", roi=False):
+    if cut_threshold == "sampling":
+        cut_threshold = SCENE_CUT_THRESHOLD[sampling]
+    if workers:
+        return replay_pool(frames, sampling, level, target_fps, yuyv, workers, smoothing, cut_threshold, roi)
+    sampler = open_sampler(sampling)
+    analyzer = FrameAnalyzer(yuv.YUVSampler(sampler) if yuyv else sampler, smoothing, cut_threshold)
+    if roi:
+        frames = roi_frames(frames, analyzer.detector.threshold, yuyv)
+    analyzer.configure(*LEVELS[level])
+    governor = QualityGovernor(target_fps) if target_fps else None
+    leds = null_leds()
+    leds.start()
+
+    stages = ("read frame",) + FrameAnalyzer.STAGES + ("led io", "iter")
+    timings = {stage: [] for stage in stages}
+    skipped = {"static frames": 0, "led writes skipped": 0, "cadence skipped": 0}
+    # frames replayed at each quality level
+    levels = [0] * len(LEVELS)
+    scores = []
+    cuts = 0
+
+    frames = iter(frames)
+    cpu_start = cpu_seconds([os.getpid()])
+    total_start = time.perf_counter()
+    while True:
+        iter_start = time.perf_counter()
+
+        start = time.perf_counter()
+        frame = next(frames, None)
+        read = time.perf_counter() - start
+        if frame is None:
+            break
+
+        colors = analyzer.analyze(frame, leds.get_brightness())
+
+        start = time.perf_counter()
+        if colors is None:
+            skipped[analyzer.skipped] += 1
+        else:
+            leds.show(colors)
+        led_io = time.perf_counter() - start
+
+        timings["read frame"].append(read)
+        for stage, seconds in analyzer.timings.items():
+            timings[stage].append(seconds)
+        timings["led io"].append(led_io)
+        timings["iter"].append(time.perf_counter() - iter_start)
+        if analyzer.score is not None:
+            scores.append(analyzer.score)
+        cuts += analyzer.cut
+
+        if governor is not None:
+            levels[governor.level] += 1
+            if governor.update(timings["iter"][-1] - read):
+                analyzer.configure(*governor.settings)
+        else:
+            levels[level] += 1
+    total = time.perf_counter() - total_start
+    cpu = cpu_seconds([os.getpid()]) - cpu_start
+
+    frame_count = len(timings["iter"])
+    return {
+        "frames": frame_count,
+        "fps": frame_count / total if total else 0,
+        "cpu": cpu / total if total else 0,
+        "skipped": skipped,
+        "levels": levels,
+        "scene": scene_report(scores, cuts),
+        "stages": {stage: percentiles(samples) for stage, samples in timings.items() if samples},
+    }
+
+# Same as replay, but analyzing in worker processes: this process copies each
+# frame into a free ring slot (waiting for one if all are in flight), a
+# PoolOutput thread shows the results. Analysis stages are timed in the
+# workers, "iter" is this loop's time per frame.
+def replay_pool(frames, sampling, level, target_fps, yuyv, workers, smoothing, cut_threshold, roi):
+    sampler = open_sampler(sampling)
+    analyzer = FrameAnalyzer(yuv.YUVSampler(sampler) if yuyv else sampler, smoothing, cut_threshold)
+    if roi:
+        frames = roi_frames(frames, analyzer.detector.threshold, yuyv)
+    governor = QualityGovernor(target_fps) if target_fps else None
+    leds = null_leds()
+    leds.start()
+
+    stages = ("read frame", "ring copy") + FrameAnalyzer.STAGES + ("led io", "iter")
+    timings = {stage: [] for stage in stages}
+    skipped = {"static frames": 0, "led writes skipped": 0, "cadence skipped": 0, "late results": 0}
+    levels = [0] * len(LEVELS)
+    scores = []
+    cuts = []
+    finished = []
+
+    def on_result(skip, stage_timings, score, cut):
+        for stage, seconds in stage_timings.items():
+            timings[stage].append(seconds)
+        if skip is not None:
+            skipped[skip] += 1
+        if score is not None:
+            scores.append(score)
+        if cut:
+            cuts.append(cut)
+        if governor is not None:
+            governor.update(sum(stage_timings.values()) / workers)
+        finished.append(skip)
+
+    frames = iter(frames)
+    first = next(frames, None)
+    if first is None:
+        return replay([], sampling, level, target_fps, yuyv, 0, smoothing, cut_threshold)
+    pool = AnalysisPool(analyzer, workers, slot_bytes=max(SLOT_BYTES, first.nbytes))
+    output = PoolOutput(pool, leds, {"led io": 0}, on_result, SimpleNamespace(observe=timings["led io"].append))
+    pool.start()
+    output.start()
+
+    def wait_finished(count):
+        while len(finished) < count:
+            time.sleep(0.001)
+
+    # the first frame waits for the workers to start up, keep that out of the figures
+    pool.submit(pool.acquire(block=True), first, leds.get_brightness(), LEVELS[level])
+    wait_finished(1)
+    for samples in timings.values():
+        samples.clear()
+    skipped = dict.fromkeys(skipped, 0)
+    scores.clear()
+    cuts.clear()
+    finished.clear()
+
+    pids = [os.getpid()] + [process.pid for process in pool.processes]
+    cpu_start = cpu_seconds(pids)
+    total_start = time.perf_counter()
+    submitted = 0
+    while True:
+        iter_start = time.perf_counter()
+
+        start = time.perf_counter()
+        frame = next(frames, None)
+        read = time.perf_counter() - start
+        if frame is None:
+            break
+
+        slot = pool.acquire(block=True)
+        start = time.perf_counter()
+        settings = governor.settings if governor is not None else LEVELS[level]
+        pool.submit(slot, frame, leds.get_brightness(), settings)
+        submitted += 1
+        levels[LEVELS.index(settings)] += 1
+
+        timings["read frame"].append(read)
+        timings["ring copy"].append(time.perf_counter() - start)
+        timings["iter"].append(time.perf_counter() - iter_start)
+    wait_finished(submitted)
+    total = time.perf_counter() - total_start
+    cpu = cpu_seconds(pids) - cpu_start
+
+    output.stop()
+    pool.stop()
+    return {
+        "frames": submitted,
+        "fps": submitted / total if total else 0,
+        "cpu": cpu / total if total else 0,
+        "skipped": skipped,
+        "levels": levels,
+        "scene": scene_report(scores, len(cuts)),
+        "stages": {stage: percentiles(samples) for stage, samples in timings.items() if samples},
+    }
+
+def scene_report(scores, cuts):
+    return {"score": percentiles(scores) if scores else None, "cuts": cuts}
+
+def print_report(name, result):
+    print(f"{name}: {result['frames']} frames, {result['fps']:.1f} fps, {result['cpu']:.2f} of {os.cpu_count()} cores busy")
+    print(f"  {'stage':<16} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'mean ms':>8}")
+    for stage, p in result["stages"].items():
+        print(f"  {stage:<16} {p['p50'] * 1e3:8.3f} {p['p95'] * 1e3:8.3f} {p['p99'] * 1e3:8.3f} {p['mean'] * 1e3:8.3f}")
+    skipped = result["skipped"]
+    print(f"  static frames skipped: {skipped['static frames']}, unchanged led writes skipped: {skipped['led writes skipped']}, "
+          f"skipped between analyzed frames: {skipped['cadence skipped']}"
+          + (f", late results: {skipped['late results']}" if "late results" in skipped else ""))
+    print(f"  frames per quality level: {result['levels']}")
+    scene = result["scene"]
+    if scene["score"] is not None:
+        p = scene["score"]
+        print(f"  scene change score: p50 {p['p50']:.4f}, p95 {p['p95']:.4f}, p99 {p['p99']:.4f}, cuts: {scene['cuts']}")
+
+# Largest per-channel difference between the colors sampled at each of the
+# governor's row strides and at full resolution, worst case and 99th
+# percentile over the (bounds-cropped) frames; the analysis path itself is
+# bypassed so smoothing doesn't blur it. DECIMATION_ERROR_BOUND is per
+# horizontal edge crossing a zone (see governor.py), so it's only checked
+# with `bounded`, for frames known to have few edges per zone.
+def check_decimation(frames, sampling="zones", bounded=True):
+    full = open_sampler(sampling)
+    strides = sorted({stride for stride, _, _ in LEVELS if stride > 1})
+    samplers = {stride: open_sampler(sampling) for stride in strides}
+    for stride, sampler in samplers.items():
+        sampler.set_stride(stride)
+    detector = FrameAnalyzer(full).detector
+    frame_errors = {stride: [] for stride in strides}
+    for frame in frames:
+        frame = detector.apply(frame)
+        reference = full.means(frame).astype(np.int16)
+        for stride, sampler in samplers.items():
+            frame_errors[stride].append(int(np.abs(sampler.means(frame) - reference).max()))
+    errors = {stride: max(errors, default=0) for stride, errors in frame_errors.items()}
+    return {"bound": DECIMATION_ERROR_BOUND if bounded else None, "errors": errors,
+            "p99": {stride: float(np.percentile(errors, 99)) if errors else 0.0 for stride, errors in frame_errors.items()},
+            "ok": not bounded or all(error <= DECIMATION_ERROR_BOUND for error in errors.values())}
+
+# Largest per-channel difference between sampling the YUYV encoding of each
+# frame directly and decoding it to bgr first, over the cropped frames.
+def check_yuv(frames, sampling="zones"):
+    reference = open_sampler(sampling)
+    sampler = yuv.YUVSampler(open_sampler(sampling))
+    detector = FrameAnalyzer(reference).detector
+    error = 0
+    for frame in frames:
+        # crop on macropixels so both sample exactly the same pixels
+        frame = yuv.bgr_to_yuyv(yuv.apply_bounds(frame, detector.update(frame)))
+        colors = reference.means(yuv.yuyv_to_bgr(frame)).astype(np.int16)
+        error = max(error, int(np.abs(sampler.means(frame) - colors).max()))
+    return {"bound": YUV_ERROR_BOUND, "error": error, "ok": error <= YUV_ERROR_BOUND}
+
+# Mean time of the dominant color sampler over the zone averager's, on the
+# same cropped frames.
+def check_dominant_cost(frames, repeat=5):
+    dominant = open_sampler("dominant")
+    zones = open_sampler("zones")
+    detector = FrameAnalyzer(zones).detector
+    times = {"dominant": 0, "zones": 0}
+    for frame in frames:
+        frame = detector.apply(frame)
+        for name, sampler in (("dominant", dominant), ("zones", zones)):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                sampler.means(frame)
+            times[name] += time.perf_counter() - start
+    ratio = times["dominant"] / times["zones"] if times["zones"] else 0
+    return {"bound": DOMINANT_COST_BOUND, "ratio": ratio, "ok": ratio <= DOMINANT_COST_BOUND}
+
+# Shows frames on the leds split over fake strips that take as long as real
+# ones; the strips are flushed at once, so that has to take about as long as
+# the longest strip alone, not all of them one after another.
+def check_strips(counts=(LED_COUNT * 3 // 5, LED_COUNT - LED_COUNT * 3 // 5), repeat=50):
+    leds = DMALeds(StripManager([FakeDevice([count], wire_time=True) for count in counts]))
+    leds.start()
+    colors = np.zeros((LED_COUNT, 3), dtype=np.uint8)
+    times = []
+    for i in range(repeat):
+        colors[:] = i
+        start = time.perf_counter()
+        leds.show(colors)
+        times.append(time.perf_counter() - start)
+    leds.cleanup()
+    slowest = 1 / max_fps(max(counts))
+    show = float(np.median(times))
+    return {"counts": list(counts), "bound": STRIP_FLUSH_BOUND, "show": show, "slowest": slowest, "sequential": sum(1 / max_fps(count) for count in counts),
+            "ok": show <= STRIP_FLUSH_BOUND * slowest}
+
+# Scene cuts found with the sampling mode's threshold on scene_frames, and
+# frames taken for cuts within a scene; no smoothing, every frame analyzed
+def check_scene_cuts(sampling="zones", threshold="sampling", scenes=8):
+    if threshold == "sampling":
+        threshold = SCENE_CUT_THRESHOLD[sampling]
+    found = false = 0
+    for seed in range(SCENE_SEEDS):
+        analyzer = FrameAnalyzer(open_sampler(sampling), 1, threshold)
+        for i, frame in enumerate(scene_frames(scenes, seed=seed)):
+            analyzer.analyze(frame, 255)
+            if i % SCENE_LENGTH:
+                false += analyzer.cut
+            elif i:
+                found += analyzer.cut
+    recall = found / (SCENE_SEEDS * (scenes - 1))
+    false_cuts = false / (SCENE_SEEDS * scenes * (SCENE_LENGTH - 1))
+    return {"threshold": threshold, "recall": recall, "false_cuts": false_cuts, "bound": {"recall": SCENE_CUT_RECALL, "false_cuts": 0},
+            "ok": threshold is None or (recall >= SCENE_CUT_RECALL and false == 0)}
+
+# Streams synthetic pictures through V4L2Capture from a FakeDriver: a third
+# of the frames full size, a third cropped to `crop`, a third full size again;
+# with `scales` the driver can't crop without scaling, so set_crop declines
+def check_v4l2(frames=90, scales=False, crop=(20, 159, 32, 287)):
+    pictures = list(synthetic_frames("motion", 8, 320, 180))
+    driver = FakeDriver(pictures, scales=scales)
+    cap = V4L2Capture("fake", io=driver)
+    cap.start()
+    check_frame = lambda frame: np.array_equal(frame, driver.picture(cap.current))
+    parts = [check_capture(cap, frames // 3, check_frame=check_frame)]
+    cropped = cap.set_crop(list(crop))
+    shape = cap.height, cap.width
+    parts.append(check_capture(cap, frames // 3, check_frame=check_frame))
+    cap.set_crop(None)
+    parts.append(check_capture(cap, frames // 3, check_frame=check_frame))
+    cap.release()
+    crop_ok = (cropped, cap.crop is None) == (not scales, True) and \
+        shape == ((180, 320) if scales else (crop[1] - crop[0] + 1, crop[3] - crop[2] + 1))
+    result = {name: sum(part[name] for part in parts) for name in ("frames", "captured", "consumed", "dropped")}
+    result.update({"shape": parts[1]["shape"], "driver_captured": driver.captured(), "driver_skipped": driver.skipped,
+                   "crop_ok": crop_ok, "shapes_ok": all(part["shapes_ok"] for part in parts),
+                   "sequence_ok": all(part["sequence_ok"] for part in parts), "contents_ok": all(part["contents_ok"] for part in parts),
+                   "counters_ok": all(part["counters_ok"] for part in parts) and result["captured"] == driver.captured()})
+    result["ok"] = crop_ok and all(part["ok"] for part in parts) and result["counters_ok"]
+    return result
+
+def print_decimation(name, result):
+    errors = ", ".join(f"stride {stride}: {error} (p99 {result['p99'][stride]:.0f})" for stride, error in result["errors"].items())
+    if result["bound"] is None:
+        print(f"{name}: decimation error {errors}, measured")
+    else:
+        print(f"{name}: decimation error {errors} (bound {result['bound']}) {'PASS' if result['ok'] else 'FAIL'}")
+
+def print_dominant_cost(name, result):
+    print(f"{name}: dominant costs {result['ratio']:.2f}x the zone means (bound {result['bound']}x) {'PASS' if result['ok'] else 'FAIL'}")
+
+def print_strips(name, result):
+    print(f"{name}: {' + '.join(map(str, result['counts']))} leds shown in {result['show'] * 1e3:.2f} ms, longest strip alone "
+          f"{result['slowest'] * 1e3:.2f} ms, one after another {result['sequential'] * 1e3:.2f} ms (bound {result['bound']}x) "
+          f"{'PASS' if result['ok'] else 'FAIL'}")
+
+def print_scene_cuts(name, result):
+    if result["threshold"] is None:
+        print(f"{name}: never cutting, not checked")
+        return
+    print(f"{name}: threshold {result['threshold']}, {result['recall']:.0%} of cuts found (bound {SCENE_CUT_RECALL:.0%}), "
+          f"{result['false_cuts']:.1%} of pan frames cut (bound 0%) {'PASS' if result['ok'] else 'FAIL'}")
+
+def print_v4l2(name, result):
+    failed = [check[:-3] for check in ("crop_ok", "shapes_ok", "sequence_ok", "contents_ok", "counters_ok") if not result[check]]
+    print(f"{name}: {result['frames']} frames, cropped to {'x'.join(map(str, result['shape']))}, captured {result['captured']} "
+          f"(driver {result['driver_captured']}), consumed {result['consumed']}, dropped {result['dropped']} "
+          f"({result['driver_skipped']} skipped by the driver) {'PASS' if result['ok'] else 'FAIL ' + ', '.join(failed)}")
+
+def print_yuv(name, result):
+    print(f"{name}: yuyv vs bgr error {result['error']} (bound {result['bound']}) {'PASS' if result['ok'] else 'FAIL'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay frames through the video pipeline and time each stage")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--synthetic", choices=SYNTHETIC, help="generated frames (default: all three kinds)")
+    source.add_argument("--npy", help=".npy stack of frames, shape (n, height, width, 3), bgr")
+    source.add_argument("--video", help="video file readable by cv2")
+    parser.add_argument("--frames", type=int, default=600, help="number of frames to replay")
+    parser.add_argument("--size", default="1920x1080", help="synthetic frame size, WIDTHxHEIGHT")
+    parser.add_argument("--sampling", choices=("zones", "edges", "dominant"), default="zones")
+    parser.add_argument("--level", type=int, choices=range(len(LEVELS)), default=0, help="fixed quality level (see governor.LEVELS)")
+    parser.add_argument("--target-fps", type=float, help="let the quality governor hold this frame rate instead")
+    parser.add_argument("--yuyv", action="store_true", help="replay YUYV encoded frames through the yuv sampling path")
+    parser.add_argument("--workers", type=int, default=0, help="analyze in this many worker processes")
+    parser.add_argument("--smoothing", type=int, default=SMOOTHING_WINDOW, help="smoothing window, in analyzed frames")
+    parser.add_argument("--cut-threshold", type=float,
+                        help="scene change score that counts as a cut, negative to never cut (default: per sampling mode)")
+    parser.add_argument("--roi", action="store_true", help="crop frames to the letterbox bounds in the capture layer")
+    parser.add_argument("--check", action="append", choices=CHECKS + ("all",), default=[],
+                        help="also run this self-check, exit with status 1 if it fails (repeatable)")
+    parser.add_argument("--json", action="store_true", help="print results as json")
+    args = parser.parse_args()
+    if args.yuyv and args.sampling == "dominant":
+        parser.error("dominant sampling needs bgr frames")
+    if "all" in args.check:
+        selected = [check for check in CHECKS if args.sampling != "dominant" or check not in MEAN_CHECKS]
+    else:
+        selected = list(dict.fromkeys(args.check))
+    if args.sampling == "dominant" and any(check in MEAN_CHECKS for check in selected):
+        parser.error("the decimation and yuyv checks sample means, not dominant colors")
+
+    if args.npy:
+        sources = {args.npy: lambda: npy_frames(args.npy, args.frames)}
+    elif args.video:
+        sources = {args.video: lambda: video_frames(args.video, args.frames)}
+    else:
+        width, height = (int(n) for n in args.size.split("x"))
+        kinds = [args.synthetic] if args.synthetic else SYNTHETIC
+        sources = {kind: lambda kind=kind: synthetic_frames(kind, args.frames, width, height) for kind in kinds}
+
+    replayed = sources
+    if args.yuyv:
+        if args.npy or args.video:
+            # encoding happens as frames are read, so it shows up in "read frame"
+            replayed = {name: lambda frames=frames: (yuv.bgr_to_yuyv(frame) for frame in frames()) for name, frames in sources.items()}
+        else:
+            replayed = {kind: lambda kind=kind: synthetic_frames(kind, args.frames, width, height, yuyv=True) for kind in kinds}
+
+    if args.cut_threshold is None:
+        cut_threshold = SCENE_CUT_THRESHOLD[args.sampling]
+    else:
+        cut_threshold = args.cut_threshold if args.cut_threshold >= 0 else None
+    results = {name: replay(frames(), args.sampling, args.level, args.target_fps, args.yuyv, args.workers, args.smoothing, cut_threshold, args.roi)
+               for name, frames in replayed.items()}
+    checks = {}
+    for check in selected:
+        if check == "decimation":
+            checks[check] = {name: check_decimation(frames(), args.sampling, bounded=not (args.npy or args.video))
+                             for name, frames in sources.items()}
+        elif check == "yuyv":
+            # full frame encodes and decodes are slow, a few dozen frames will do
+            checks[check] = {name: check_yuv(islice(frames(), 32), args.sampling) for name, frames in sources.items()}
+        elif check == "dominant-cost":
+            checks[check] = {name: check_dominant_cost(islice(frames(), 64)) for name, frames in sources.items()}
+        elif check == "scene-cuts":
+            checks[check] = {f"{args.sampling} scene cuts": check_scene_cuts(args.sampling, cut_threshold)}
+        elif check == "strips":
+            checks[check] = {"fake strips": check_strips()}
+        elif check == "v4l2":
+            checks[check] = {"fake v4l2 driver": check_v4l2(), "fake scaling v4l2 driver": check_v4l2(scales=True)}
+
+    if args.json:
+        print(json.dumps({"replay": results, **checks}, indent=2))
+    else:
+        for name, result in results.items():
+            print_report(name, result)
+        printers = {"decimation": print_decimation, "yuyv": print_yuv, "dominant-cost": print_dominant_cost,
+                    "scene-cuts": print_scene_cuts, "strips": print_strips, "v4l2": print_v4l2}
+        for check, check_results in checks.items():
+            for name, result in check_results.items():
+                printers[check](name, result)
+
+    if not all(result["ok"] for check in checks.values() for result in check.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import numpy as np
+
+# a pixel counts as "black" unless one of its channels exceeds this value.
+# captured letterbox bars are rarely exactly zero, so leave a little headroom
+BLACK_THRESHOLD = 16
+# number of rows/columns sampled when scanning for the picture edges
+SAMPLE_LINES = 5
+# number of consecutive agreeing frames required before bounds change
+HISTORY = 15
+
+
+def _sample_positions(length, count):
+    # evenly spaced positions strictly inside (0, length), avoiding the very edges
+    return np.linspace(0, length, count + 2, dtype=np.intp)[1:-1]
+
+def _first_last(mask):
+    # first/last True index of a 1d mask, or None if there is none
+    if not mask.any():
+        return None
+    first = int(mask.argmax())
+    last = len(mask) - 1 - int(mask[::-1].argmax())
+    return first, last
+
+def find_bounds(frame, threshold=BLACK_THRESHOLD, samples=SAMPLE_LINES):
+    height, width = frame.shape[:2]
+    rows = _sample_positions(height, samples)
+    cols = _sample_positions(width, samples)
+
+    # a line is "lit" if any sampled pixel on it has a channel above the threshold
+    lit_rows = (frame[:, cols] > threshold).any(axis=(1, 2))
+    lit_cols = (frame[rows, :] > threshold).any(axis=(0, 2))
+
+    y_bounds = _first_last(lit_rows) or (0, height - 1)
+    x_bounds = _first_last(lit_cols) or (0, width - 1)
+
+    return [y_bounds[0], y_bounds[1], x_bounds[0], x_bounds[1]]
+
+def apply_bounds(frame, bounds):
+    return frame[bounds[0]:bounds[1]+1, bounds[2]:bounds[3]+1]
+
+
+# Letterbox detection with hysteresis: the candidate bounds from each frame are
+# only adopted once `history` consecutive frames agree on them, so a dark scene
+# or a single black frame doesn't make the picture jump around.
+class BoundsDetector:
+    def __init__(self, threshold=BLACK_THRESHOLD, samples=SAMPLE_LINES, history=HISTORY):
+        self.threshold = threshold
+        self.samples = samples
+        self.history = history
+        self.bounds = None
+        self.shape = None
+        self.candidate = None
+        self.votes = 0
+
+    def reset(self):
+        self.bounds = None
+        self.shape = None
+        self.candidate = None
+        self.votes = 0
+
+    def update(self, frame):
+        shape = frame.shape[:2]
+        if shape != self.shape:
+            # resolution changed (or first frame), start over from the full frame
+            self.shape = shape
+            self.bounds = [0, shape[0] - 1, 0, shape[1] - 1]
+            self.candidate = None
+            self.votes = 0
+
+        candidate = find_bounds(frame, self.threshold, self.samples)
+        if candidate == self.bounds:
+            self.candidate = None
+            self.votes = 0
+        else:
+            if candidate != self.candidate:
+                self.candidate = candidate
+                self.votes = 0
+            self.votes += 1
+            if self.votes >= self.history:
+                self.bounds = candidate
+                self.candidate = None
+                self.votes = 0
+
+        return self.bounds
+
+    def apply(self, frame):
+        return apply_bounds(frame, self.update(frame))
@@ -0,0 +1,165 @@
+import math
+import threading
+import time
+import numpy as np
+
+# how the output moves towards newly analyzed colors: "linear" interpolates
+# from where it was to the new colors over one analysis interval, "ease"
+# closes most of the distance exponentially over the same time
+INTERPOLATION = "linear"
+# weight of each new sample in the average analysis interval
+INTERVAL_ALPHA = 0.1
+# gaps between updates longer than this many average intervals are pauses
+# (a static picture, unchanged colors), not the analysis rate, and are left
+# out of the average
+GAP_INTERVALS = 4
+# longest gap the average starts from, in seconds
+MAX_INTERVAL = 0.25
+# inter-show intervals kept for the jitter figure
+JITTER_WINDOW = 256
+
+
+# Shows colors on the leds at a fixed rate from its own thread, decoupled from
+# when frames arrive, so capture jitter doesn't turn into led stutter.
+# `show` only hands over the latest analyzed colors; updates arriving faster
+# than the clock ticks are coalesced, the newest wins. Between updates the
+# output is interpolated from the previously shown colors towards the new
+# ones, spread over the measured analysis interval: smooth, at the cost of
+# reaching each new color one interval later. Analysis sends nothing while the
+# picture or colors don't change, so the interval is measured only between
+# updates that follow each other (see GAP_INTERVALS); after a pause the
+# output still moves at the pace updates normally arrive at. A producer that
+# slows down a lot at once makes the output move faster than it could, never
+# slower.
+#
+# Ticks that don't change anything are skipped, and ticks the thread woke up
+# too late for are dropped rather than bunched up. The spacing of the shows
+# that do happen back to back is kept to report the jitter.
+class OutputClock:
+
+    def __init__(self, leds, rate, counters, led_io=None, interpolation=INTERPOLATION):
+        self.leds = leds
+        self.period = 1 / rate
+        self.counters = counters
+        self.led_io = led_io
+        self.interpolation = interpolation
+        self.lock = threading.Lock()
+        self.target = None
+        self.target_time = 0
+        self.pending = False
+        self.interval = 0
+        self.shown = None
+        self.shown_brightness = None
+        self.coalesced = 0
+        self.gaps = 0
+        self.late = 0
+        self.shows = 0
+        self.intervals = np.zeros(JITTER_WINDOW)
+        self.interval_count = 0
+        self.last_show = None
+        self.running = False
+        self.t = threading.Thread(target=self._tick)
+        self.t.daemon = True
+
+    def start(self):
+        self.running = True
+        self.t.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self.t.join()
+
+    def get_brightness(self):
+        return self.leds.get_brightness()
+
+    # new analyzed colors to move towards, (N, 3) rgb as for DMALeds.show;
+    # on a scene cut the output jumps to them on the next tick instead
+    def show(self, colors, cut=False):
+        now = time.perf_counter()
+        with self.lock:
+            if self.target is None or self.target.shape != np.shape(colors):
+                self.target = np.array(colors, dtype=np.float32)
+                self.start_colors = self.target.copy()
+                self.current = self.target.copy()
+            else:
+                if self.pending:
+                    self.coalesced += 1
+                sample = now - self.target_time
+                if self.interval == 0:
+                    if sample <= MAX_INTERVAL:
+                        self.interval = sample
+                elif sample <= GAP_INTERVALS * self.interval:
+                    self.interval += INTERVAL_ALPHA * (sample - self.interval)
+                else:
+                    self.gaps += 1
+                # move on from wherever the output is right now
+                np.copyto(self.start_colors, self.current)
+                self.target[:] = colors
+                if cut:
+                    np.copyto(self.start_colors, self.target)
+                    np.copyto(self.current, self.target)
+            self.target_time = now
+            self.pending = True
+
+    def _step(self, now):
+        # advances self.current to `now`, under the lock
+        if self.interval == 0:
+            np.copyto(self.current, self.target)
+        elif self.interpolation == "ease":
+            # most (95%) of the way there after one analysis interval
+            self.current += (1 - math.exp(-3 * self.period / self.interval)) * (self.target - self.current)
+        else:
+            progress = min(1, (now - self.target_time) / self.interval)
+            np.subtract(self.target, self.start_colors, out=self.current)
+            self.current *= progress
+            self.current += self.start_colors
+        self.pending = False
+        return np.rint(self.current).astype(np.uint8)
+
+    def _tick(self):
+        deadline = time.perf_counter()
+        while self.running:
+            deadline += self.period
+            remaining = deadline - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+            elif remaining < -self.period:
+                # fell more than a tick behind, start over from now
+                skipped = int(-remaining / self.period)
+                self.late += skipped
+                deadline += skipped * self.period
+
+            now = time.perf_counter()
+            with self.lock:
+                if self.target is None:
+                    continue
+                colors = self._step(now)
+            brightness = self.leds.get_brightness()
+            if brightness == self.shown_brightness and np.array_equal(colors, self.shown):
+                self.last_show = None
+                continue
+
+            start = time.perf_counter()
+            self.leds.show(colors)
+            seconds = time.perf_counter() - start
+            self.counters["led io"] += seconds
+            if self.led_io is not None:
+                self.led_io.observe(seconds)
+            if self.last_show is not None:
+                self.intervals[self.interval_count % JITTER_WINDOW] = start - self.last_show
+                self.interval_count += 1
+            self.last_show = start
+            self.shows += 1
+            self.shown = colors
+            self.shown_brightness = brightness
+
+    # standard deviation of the latest inter-show intervals, in seconds
+    def jitter(self):
+        count = min(self.interval_count, JITTER_WINDOW)
+        return float(self.intervals[:count].std()) if count > 1 else 0.0
+
+    def mean_interval(self):
+        count = min(self.interval_count, JITTER_WINDOW)
+        return float(self.intervals[:count].mean()) if count else 0.0
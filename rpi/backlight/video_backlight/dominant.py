@@ -0,0 +1,104 @@
+import numpy as np
+from .zones import split_edges
+
+# bits kept per channel when binning colors, 4 gives a 4096 color palette
+PALETTE_BITS = 4
+# only every STRIDE'th row and column is binned; the most common color of a
+# zone survives sampling far better than its exact mean would need
+STRIDE = 4
+
+
+# Most common color per zone instead of the average, so a high contrast scene
+# gives the colors that are actually on screen rather than a muddy mix.
+#
+# Every sampled pixel is quantized to PALETTE_BITS per channel and tagged with
+# its zone, giving one combined zone+color index, so a single np.bincount
+# builds the histograms of all zones at once. The peak bin of each zone wins,
+# and its color is the average of the pixels that fell in it, so it doesn't
+# step by whole palette entries as a scene fades.
+#
+# The peak bin of a zone can flip between two near equal colors from one frame
+# to the next, which looks like a cut to the scene change score, so the zones'
+# mean colors are kept alongside in `scene_colors` to score on instead: the
+# histograms' counts times their bins' center colors, one small product.
+#
+# Zones are the same row-major rows x cols grid as ZoneAverager, and `means`
+# is named for that interface.
+class DominantSampler:
+
+    def __init__(self, rows=2, cols=3, bits=PALETTE_BITS, stride=STRIDE):
+        self.rows = rows
+        self.cols = cols
+        self.count = rows * cols
+        self.bits = bits
+        self.base_stride = stride
+        self.stride = 1
+        self.bins = 1 << (3 * bits)
+        # the combined index has to fit the uint16 it's built in
+        assert self.count * self.bins <= 1 << 16
+        self.shape = None
+
+    # extra row stride asked for by the quality governor
+    def set_stride(self, stride):
+        if stride != self.stride:
+            self.stride = stride
+            self.shape = None
+
+    def _prepare(self, shape):
+        if len(shape) != 3 or shape[2] != 3:
+            raise ValueError(f"dominant color sampling needs bgr frames, got {shape}")
+        self.shape = shape
+        self.row_step = self.base_stride * self.stride
+        rows = np.arange(0, shape[0], self.row_step)
+        cols = np.arange(0, shape[1], self.base_stride)
+        row_edges, _ = split_edges(shape[0], self.rows)
+        col_edges, _ = split_edges(shape[1], self.cols)
+        row_zone = np.searchsorted(row_edges, rows, side="right") - 1
+        col_zone = np.searchsorted(col_edges, cols, side="right") - 1
+        self.zones = (row_zone[:, np.newaxis] * self.cols + col_zone).astype(np.uint16)
+        # where each zone's histogram starts in the combined one
+        self.offsets = self.zones * self.bins
+        self.zone_starts = np.arange(self.count, dtype=np.uint16) * self.bins
+        sampled = (len(rows), len(cols))
+        self.quantized = np.empty(sampled + (3,), dtype=np.uint8)
+        self.index = np.empty(sampled, dtype=np.uint16)
+        self.scratch = np.empty(sampled, dtype=np.uint16)
+        self.colors = np.zeros((self.count, 3), dtype=np.uint8)
+        # center color of every bin, channels in frame order like the index
+        levels = np.arange(self.bins)
+        shifts = (2 * self.bits, self.bits, 0)
+        self.palette = np.stack([(levels >> shift) & ((1 << self.bits) - 1) for shift in shifts], axis=1) \
+            * (1 << (8 - self.bits)) + (1 << (7 - self.bits)) - 0.5
+        self.zone_pixels = np.bincount(self.zones.ravel(), minlength=self.count)[:, np.newaxis]
+        self.scene_colors = np.zeros((self.count, 3))
+
+    def means(self, frame):
+        if frame.shape != self.shape:
+            self._prepare(frame.shape)
+        bits = self.bits
+        sample = frame[::self.row_step, ::self.base_stride]
+
+        # zone + quantized b, g, r as one index
+        quantized, index, scratch = self.quantized, self.index, self.scratch
+        np.right_shift(sample, 8 - bits, out=quantized)
+        np.left_shift(quantized[:, :, 0], 2 * bits, out=index, dtype=np.uint16)
+        np.left_shift(quantized[:, :, 1], bits, out=scratch, dtype=np.uint16)
+        index |= scratch
+        index |= quantized[:, :, 2]
+        index += self.offsets
+
+        histograms = np.bincount(index.ravel(), minlength=self.count * self.bins)
+        np.divide(histograms.reshape(self.count, self.bins) @ self.palette, self.zone_pixels, out=self.scene_colors)
+        peaks = histograms.reshape(self.count, self.bins).argmax(axis=1).astype(np.uint16)
+        peaks += self.zone_starts
+
+        # average the pixels that landed in their zone's peak bin
+        in_peak = index == peaks[self.zones]
+        zones = self.zones[in_peak]
+        pixels = sample[in_peak]
+        counts = np.bincount(zones, minlength=self.count)
+        filled = counts != 0
+        for channel in range(3):
+            sums = np.bincount(zones, weights=pixels[:, channel], minlength=self.count)
+            self.colors[filled, channel] = sums[filled] / counts[filled]
+        return self.colors
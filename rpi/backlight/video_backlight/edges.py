@@ -0,0 +1,60 @@
+import numpy as np
+from .leds import LED_BOTTOM, LED_RIGHT, LED_TOP, LED_LEFT
+from .zones import ZoneAverager
+
+# how far into the picture each led's patch reaches, as a fraction of the
+# frame height (top/bottom leds) or width (left/right leds)
+BAND_DEPTH = 0.1
+
+
+# Samples one patch of the screen border per led, following the strip around
+# the tv: bottom (left to right), right (bottom to top), top (right to left),
+# left (top to bottom). Only the four border bands are ever read, the
+# interior of the frame is never touched.
+#
+# Each band is a grid of patches, one row deep along the top and bottom and
+# one column deep along the sides, so every side is reduced by its own
+# ZoneAverager: all of that side's patches come out of one pass over the
+# band, summing along the axis numpy reduces fastest. The averagers cache
+# their split tables per band shape, which only changes along with the
+# bounds or the resolution.
+class EdgeSampler:
+
+    def __init__(self, bottom=LED_BOTTOM, right=LED_RIGHT, top=LED_TOP, left=LED_LEFT, depth=BAND_DEPTH):
+        self.count = bottom + right + top + left
+        self.depth = depth
+        self.bottom = ZoneAverager(1, bottom)
+        self.right = ZoneAverager(right, 1)
+        self.top = ZoneAverager(1, top)
+        self.left = ZoneAverager(left, 1)
+        # where each side starts in the strip
+        self.offsets = np.cumsum([0, bottom, right, top, left])
+        self.shape = None
+
+    # sample every stride'th row of each patch, see ZoneAverager
+    def set_stride(self, stride):
+        for side in (self.bottom, self.right, self.top, self.left):
+            side.set_stride(stride)
+
+    def _prepare(self, shape):
+        self.shape = shape
+        self.y_depth = max(1, int(shape[0] * self.depth))
+        self.x_depth = max(1, int(shape[1] * self.depth))
+        self.colors = np.empty((self.count,) + tuple(shape[2:]), dtype=np.uint8)
+        o = self.offsets
+        # output views in strip order; the right and top sides run backwards
+        # relative to the frame's row/column order
+        self.out_bottom = self.colors[o[0]:o[1]]
+        self.out_right = self.colors[o[1]:o[2]][::-1]
+        self.out_top = self.colors[o[2]:o[3]][::-1]
+        self.out_left = self.colors[o[3]:o[4]]
+
+    def means(self, frame):
+        if frame.shape != self.shape:
+            self._prepare(frame.shape)
+        y_depth, x_depth = self.y_depth, self.x_depth
+        self.out_bottom[:] = self.bottom.means(frame[-y_depth:])
+        self.out_right[:] = self.right.means(frame[:, -x_depth:])
+        self.out_top[:] = self.top.means(frame[:y_depth])
+        self.out_left[:] = self.left.means(frame[:, :x_depth])
+        return self.colors
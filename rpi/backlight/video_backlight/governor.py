@@ -0,0 +1,68 @@
+import math
+from .zones import MIN_SAMPLED_ROWS
+
+# Quality levels, best first: (row stride, analysis cadence, smoothing window).
+# The row stride samples every n'th row of each zone (see ZoneAverager), the
+# cadence analyzes every n'th frame and the smoothing window eases the leds
+# over the frames in between so the lower rate doesn't show as stepping.
+LEVELS = (
+    (1, 1, 1),
+    (2, 1, 1),
+    (4, 1, 2),
+    (4, 2, 3),
+    (4, 3, 4),
+)
+# Largest difference (out of 255, per channel) between the zone means at any
+# level's stride and at full resolution, per horizontal edge crossing a zone:
+# ZoneAverager keeps at least MIN_SAMPLED_ROWS rows per zone, so one edge
+# shifts the mean by at most one sampled row's worth. Pictures with many
+# edges in a zone add up one bound per edge, and fine horizontal detail
+# (stripes a few rows high, a stride's multiple apart) can be off by up to
+# full scale. It isn't a bound on footage: the benchmark's `--check
+# decimation` measures the actual error on frames given with --npy or
+# --video, and only holds its synthetic blocky frames to this.
+DECIMATION_ERROR_BOUND = math.ceil(255 / MIN_SAMPLED_ROWS)
+
+# share of the frame budget above which quality drops a level, and below which
+# it comes back; far enough apart that halving the cost doesn't bounce
+DEGRADE_LOAD = 0.9
+IMPROVE_LOAD = 0.4
+# iterations between decisions, and the weight of each new cost sample
+INTERVAL = 30
+COST_ALPHA = 0.1
+
+
+# Watches what each iteration costs (excluding the wait for the next frame)
+# against the budget of the target frame rate and steps through LEVELS to
+# hold it: down when the loop is using up most of the budget, back up once
+# there is plenty to spare.
+class QualityGovernor:
+
+    def __init__(self, target_fps, levels=LEVELS, interval=INTERVAL):
+        self.budget = 1 / target_fps
+        self.levels = levels
+        self.interval = interval
+        self.level = 0
+        self.cost = 0
+        self.count = 0
+
+    @property
+    def settings(self):
+        return self.levels[self.level]
+
+    # feed one iteration's cost in seconds, returns True if the level changed
+    def update(self, cost):
+        self.cost += COST_ALPHA * (cost - self.cost)
+        self.count += 1
+        if self.count < self.interval:
+            return False
+        self.count = 0
+
+        load = self.cost / self.budget
+        if load > DEGRADE_LOAD and self.level < len(self.levels) - 1:
+            self.level += 1
+        elif load < IMPROVE_LOAD and self.level > 0:
+            self.level -= 1
+        else:
+            return False
+        return True
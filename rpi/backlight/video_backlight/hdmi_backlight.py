@@ -2,10 +2,53 @@ import time
 import signal
 import sys
 import numpy as np
-from serial import Serial
-from multiprocessing.pool import ThreadPool
-from .leds import DMALeds
+import metrics
+from .leds import DMALeds, LED_MAX_FPS
 from .videocapture import BufferlessVideoCapture
+from .v4l2capture import V4L2Capture, PIX_FMT_BGR24, PIX_FMT_YUYV
+from .zones import ZoneAverager
+from .edges import EdgeSampler
+from .dominant import DominantSampler
+from .yuv import YUVSampler
+from .analysis import FrameAnalyzer
+from .governor import QualityGovernor, LEVELS
+from .pipeline import Handoff, OutputStage
+from .workers import AnalysisPool, PoolOutput, SLOT_BYTES
+from .clock import OutputClock
+from .scenecut import CUT_THRESHOLDS
+from .roi import ROICapture
+
+# "cv2" captures through OpenCV, "v4l2" reads the driver's mmap buffers directly
+CAPTURE_BACKEND = "cv2"
+V4L2_DEVICE = "/dev/video0"
+# "bgr" has every frame converted to bgr, "yuyv" captures raw YUYV and only
+# converts the sampled colors
+CAPTURE_FORMAT = "bgr"
+# capture only the picture inside the letterbox bars: cropped by the driver
+# where V4L2 supports it, otherwise handed out as a view of the full frame,
+# so the ring copy and the analysis never touch the bars (see roi.py)
+CAPTURE_ROI = False
+# show LEDs from a separate output thread so led io overlaps the next frame's analysis
+PIPELINED = False
+# analyze frames in this many worker processes fed through shared memory,
+# 0 analyzes in the capture loop; when set, PIPELINED has no effect
+ANALYSIS_WORKERS = 0
+# show LEDs on a fixed clock of this many Hz (e.g. 120, capped at LED_MAX_FPS),
+# easing between analyzed frames; None shows each frame as it's analyzed.
+# When set, PIPELINED has no effect
+OUTPUT_RATE = None
+# "zones" averages six screen zones, "edges" samples a border patch per led,
+# "dominant" takes the most common color of each of the six zones
+SAMPLING_MODE = "zones"
+# frame rate the quality governor tries to hold by lowering sampling resolution,
+# analysis rate and smoothing; None always runs at full quality
+TARGET_FPS = 30
+# colors are eased over about this many analyzed frames (1 shows each as is),
+# except across hard cuts: a scene change score above the sampling mode's
+# threshold makes the leds jump to the new scene at once. None for a mode never
+# treats a change as a cut
+SMOOTHING_WINDOW = 6
+SCENE_CUT_THRESHOLD = dict(CUT_THRESHOLDS)
 
 # performance counters
 counters = {
@@ -13,38 +56,129 @@ counters = {
     "processing mean": 0,
     "led io": 0,
     "iter": 0,
-    "bounds": 0
+    "bounds": 0,
+    "output stall": 0,
+    "static check": 0,
+    "static frames": 0,
+    "led writes skipped": 0,
+    "cadence skipped": 0,
+    "ring copy": 0,
+    "ring full": 0,
+    "late results": 0,
+    "scene cuts": 0
 }
 iters = 0
 cap = None
 leds = None
+output = None
+handoff = None
+pool = None
+clock = None
+
+# live metrics, served at GET /metrics
+stage_metrics = {
+    "read frame": metrics.histogram("backlight_video_frame_read_seconds", "Time spent waiting for a captured frame"),
+    "static check": metrics.histogram("backlight_video_static_check_seconds", "Time spent checking whether the picture changed"),
+    "bounds": metrics.histogram("backlight_video_bounds_seconds", "Time spent detecting and applying letterbox bounds"),
+    "processing mean": metrics.histogram("backlight_video_zone_mean_seconds", "Time spent sampling colors from the frame"),
+    "led io": metrics.histogram("backlight_video_led_io_seconds", "Time spent writing colors to the leds"),
+}
+frames_total = metrics.counter("backlight_video_frames_total", "Frames processed by the video loop")
+frames_skipped = metrics.counter("backlight_video_frames_skipped_total", "Frames that needed no led update")
+frames_dropped = metrics.counter("backlight_video_frames_dropped_total", "Captured frames replaced before the video loop read them",
+                                 fn=lambda: cap.stats()["dropped"] if cap is not None else 0)
+output_jitter = metrics.gauge("backlight_video_output_jitter_seconds", "Standard deviation of the intervals between led updates on the output clock",
+                              fn=lambda: clock.jitter() if clock is not None else 0)
+output_interval = metrics.gauge("backlight_video_output_interval_seconds", "Mean interval between led updates on the output clock",
+                                fn=lambda: clock.mean_interval() if clock is not None else 0)
+output_coalesced = metrics.counter("backlight_video_output_coalesced_total", "Analyzed colors replaced before the output clock showed them",
+                                   fn=lambda: clock.coalesced if clock is not None else 0)
+output_late = metrics.counter("backlight_video_output_late_ticks_total", "Output clock ticks dropped because the clock fell behind",
+                              fn=lambda: clock.late if clock is not None else 0)
+fps_gauge = metrics.gauge("backlight_video_fps", "Frames per second processed by the video loop, over the last second")
+scene_score = metrics.histogram("backlight_video_scene_change_score", "Scene change score of each sampled frame, 0 to 1",
+                                buckets=(0.005, 0.01, 0.02, 0.05, 0.1, 0.15, 0.2, 0.3, 0.5))
+scene_cuts = metrics.counter("backlight_video_scene_cuts_total", "Frames whose scene change score crossed the cut threshold")
+capture_roi = metrics.gauge("backlight_video_capture_roi_fraction", "Fraction of the full frame passed on by the capture",
+                            fn=lambda: cap.fraction() if isinstance(cap, ROICapture) else 1)
+capture_crops = metrics.counter("backlight_video_capture_crops_total", "Times the capture driver was asked for a new crop",
+                                fn=lambda: cap.crops if isinstance(cap, ROICapture) else 0)
+quality_gauge = metrics.gauge("backlight_video_quality_level", "Current quality governor level, 0 is full quality")
 
 def get_leds():
     global leds
     return leds
 
+def record_analysis(skipped, timings, score, cut):
+    for stage, seconds in timings.items():
+        counters[stage] += seconds
+        if seconds:
+            stage_metrics[stage].observe(seconds)
+    if skipped is not None:
+        counters[skipped] += 1
+        frames_skipped.inc()
+    if score is not None:
+        scene_score.observe(score)
+    if cut:
+        counters["scene cuts"] += 1
+        scene_cuts.inc()
+
 def cleanup():
-    global counters, iters, cap, leds
+    global counters, iters, cap, leds, output, handoff, pool, clock
 
     # ignore additional signals
     print("Cleaning up resources...")
+    if output is not None:
+        output.stop()
+        output = None
+        if handoff is not None:
+            counters["output stall"] += handoff.stall
+        print("Stopped LED output thread")
+    if pool is not None:
+        pool.stop()
+        counters["ring copy"] += pool.copy
+        counters["ring full"] += pool.full
+        pool = None
+        print("Stopped analysis workers")
+    if clock is not None:
+        clock.stop()
+        print("Stopped LED output clock")
     if cap is not None:
-        icap = cap.cap
-        cap.cap = None
-        time.sleep(1)
-        icap.release()
+        cap.release()
         print("Released video capture")
     if leds is not None:
         leds.show([ [0, 0, 0] for _ in range(6)])
         leds.cleanup()
         print("Cleaned up LEDs")
-    if iters is not 0:
+    if iters != 0:
         print(f"Performance statistics (average over {iters} iters):")
         print(f"  read frame:  {np.format_float_positional(counters['read frame'] / iters, trim='-')} sec ({100 * counters['read frame'] / counters['iter'] :.2f}%)")
         print(f"  adjust bounds:  {np.format_float_positional(counters['bounds'] / iters, trim='-')} sec ({100 * counters['bounds'] / counters['iter'] :.2f}%)")
         print(f"  calc mean:   {np.format_float_positional(counters['processing mean'] / iters, trim='-')} sec ({100 * counters['processing mean'] / counters['iter'] :.2f}%)")
         print(f"  led io:      {np.format_float_positional(counters['led io'] / iters, trim='-')} sec ({100 * counters['led io'] / counters['iter'] :.2f}%)")
         print(f"  iter:        {np.format_float_positional(counters['iter'] / iters, trim='-')} sec ({100 * counters['iter'] / counters['iter'] :.2f}%)")
+    if iters != 0:
+        print(f"  static check: {np.format_float_positional(counters['static check'] / iters, trim='-')} sec ({100 * counters['static check'] / counters['iter'] :.2f}%)")
+        print(f"  static frames: {counters['static frames']} skipped ({100 * counters['static frames'] / iters :.2f}%), {counters['led writes skipped']} unchanged led writes skipped")
+        print(f"  cadence:     {counters['cadence skipped']} frames skipped between analyzed frames ({100 * counters['cadence skipped'] / iters :.2f}%)")
+        print(f"  scene cuts:  {counters['scene cuts']}")
+    if isinstance(cap, ROICapture) and iters != 0:
+        print(f"  capture roi: {cap.roi}, {100 * cap.fraction():.1f}% of the frame, " + (f"{cap.crops} driver crops" if cap.can_crop else "cropped as views"))
+    if ANALYSIS_WORKERS and iters != 0:
+        print(f"  ring copy:   {np.format_float_positional(counters['ring copy'] / iters, trim='-')} sec ({100 * counters['ring copy'] / counters['iter'] :.2f}%)")
+        print(f"  workers:     {ANALYSIS_WORKERS}, {counters['ring full']} frames dropped with every slot in flight, {counters['late results']} late results dropped")
+    if clock is not None:
+        if clock.shows != 0:
+            print(f"  output clock: {clock.shows} shows, {1000 * clock.mean_interval():.2f} ms apart, jitter {1000 * clock.jitter():.3f} ms, "
+                  f"{clock.coalesced} updates coalesced, {clock.late} late ticks dropped")
+        clock = None
+    if handoff is not None and iters != 0:
+        print(f"  output stall: {np.format_float_positional(counters['output stall'] / iters, trim='-')} sec ({100 * counters['output stall'] / counters['iter'] :.2f}%)")
+        print(f"  output queue depth: {handoff.mean_depth():.2f} (of {handoff.depth} buffers)")
+    if cap is not None:
+        stats = cap.stats()
+        if stats["captured"] != 0:
+            print(f"  frames:      {stats['captured']} captured, {stats['consumed']} consumed, {stats['dropped']} dropped ({100 * stats['dropped'] / stats['captured'] :.2f}%)")
 
 def signal_handler(signum, frame):
     # ignore additional signals
@@ -52,60 +186,67 @@ def signal_handler(signum, frame):
     cleanup()
     sys.exit(0)
 
-def mean_color(frame):
-    return frame.mean(axis=0, dtype=np.uint64).mean(axis=0, dtype=np.uint64)
-
-def split(frame):
-    upper_half, lower_half = np.array_split(frame, 2)
-    upper_left, upper_middle, upper_right = np.array_split(upper_half, 3, axis=1)
-    lower_left, lower_middle, lower_right = np.array_split(lower_half, 3, axis=1)
-    return [upper_left, upper_middle, upper_right, lower_left, lower_middle, lower_right]
-
-def find_bounds(frame):
-    y_mid = frame.shape[0] // 2
-    x_mid = frame.shape[1] // 2
-
-    y_nonzero_min = 0
-    for y in range(frame.shape[0]):
-        if (frame[y,x_mid] != [0,0,0]).any():
-            y_nonzero_min = y
-            break
-
-    y_nonzero_max = frame.shape[0]-1
-    for y in range(frame.shape[0]-1, -1, -1): # range(start, stop, step)
-        if (frame[y, x_mid] != [0,0,0]).any():
-            y_nonzero_max = y
-            break
-
-    x_nonzero_min = 0
-    for x in range(frame.shape[1]):
-        if (frame[y_mid,x] != [0,0,0]).any():
-            x_nonzero_min = x
-            break
-
-    x_nonzero_max = frame.shape[1]-1
-    for x in range(frame.shape[1]-1, -1, -1): # range(start, stop, step)
-        if (frame[y_mid, x] != [0,0,0]).any():
-            x_nonzero_max = x
-            break
-
-    bounds = [y_nonzero_min, y_nonzero_max, x_nonzero_min, x_nonzero_max]
-    return bounds
-
-def apply_bounds(frame, bounds):
-    return frame[bounds[0]:bounds[1]+1, bounds[2]:bounds[3]+1]
-
-def run(lock):
-    global counters, iters, cap, leds
+def open_capture():
+    if CAPTURE_FORMAT not in ("bgr", "yuyv"):
+        raise ValueError(f"Invalid capture format: {CAPTURE_FORMAT}")
+    yuyv = CAPTURE_FORMAT == "yuyv"
+    if CAPTURE_BACKEND == "v4l2":
+        return V4L2Capture(V4L2_DEVICE, pixelformat=PIX_FMT_YUYV if yuyv else PIX_FMT_BGR24)
+    elif CAPTURE_BACKEND == "cv2":
+        return BufferlessVideoCapture(-1, yuyv)
+    else:
+        raise ValueError(f"Invalid capture backend: {CAPTURE_BACKEND}")
+
+def open_sampler(mode=None):
+    mode = mode or SAMPLING_MODE
+    if mode == "edges":
+        return EdgeSampler()
+    elif mode == "zones":
+        # zones: [upper_left, upper_middle, upper_right, lower_left, lower_middle, lower_right]
+        return ZoneAverager(2, 3)
+    elif mode == "dominant":
+        # same zones as above
+        return DominantSampler(2, 3)
+    else:
+        raise ValueError(f"Invalid sampling mode: {mode}")
+
+def start_pool(analyzer, governor, slot_bytes):
+    global pool, output
+    pool = AnalysisPool(analyzer, ANALYSIS_WORKERS, slot_bytes=slot_bytes)
+
+    def on_result(skipped, timings, score, cut):
+        record_analysis(skipped, timings, score, cut)
+        # each worker has the frame budget times the number of workers
+        if governor is not None and governor.update(sum(timings.values()) / ANALYSIS_WORKERS):
+            quality_gauge.set(governor.level)
+            print(f"Quality level {governor.level}: row stride, cadence, smoothing = {governor.settings}")
+
+    output = PoolOutput(pool, leds, counters, on_result, stage_metrics["led io"], clock)
+    pool.start()
+    output.start()
+    print(f"Analyzing in {ANALYSIS_WORKERS} worker processes")
+
+# on_open is called with the leds (see get_leds) once they're open, to apply
+# settings kept across mode changes
+def run(lock, on_open=None):
+    global counters, iters, cap, leds, output, handoff, pool, clock
+
+    # configuration errors are raised before anything is opened or the lock
+    # taken, so there's nothing to give back
+    if CAPTURE_FORMAT == "yuyv" and SAMPLING_MODE == "dominant":
+        raise ValueError("Dominant sampling needs bgr capture")
+    sampler = open_sampler()
 
     lock.acquire()
 
     leds = DMALeds()
     leds.start()
+    if on_open is not None:
+        on_open(leds)
 
-    cap = BufferlessVideoCapture(-1)
+    cap = open_capture()
 
-    if cap.cap.isOpened() and cap.cap.grab():
+    if cap.is_opened():
         print("Capturing video")
     else:
         cleanup()
@@ -114,58 +255,103 @@ def run(lock):
 
     cap.start()
 
-    pool = ThreadPool(4)
     last_check_time = None
-    bounds = None
+    fps_time = time.monotonic()
+    fps_iters = iters
+    if CAPTURE_FORMAT == "yuyv":
+        sampler = YUVSampler(sampler, *cap.yuv_encoding())
+    analyzer = FrameAnalyzer(sampler, SMOOTHING_WINDOW, SCENE_CUT_THRESHOLD[SAMPLING_MODE])
+    if CAPTURE_ROI:
+        cap = ROICapture(cap, analyzer.detector.threshold, analyzer.yuyv)
+    governor = QualityGovernor(TARGET_FPS) if TARGET_FPS else None
+    quality_gauge.set(0)
+
+    if OUTPUT_RATE:
+        clock = OutputClock(leds, min(OUTPUT_RATE, LED_MAX_FPS), counters, stage_metrics["led io"])
+        clock.start()
+    elif PIPELINED and not ANALYSIS_WORKERS:
+        handoff = Handoff((analyzer.sampler.count, 3))
+        output = OutputStage(leds, handoff, counters, stage_metrics["led io"])
+        output.start()
+
     while not lock.should_release():
         iter_start = time.perf_counter()
 
+        # blocks until a new frame arrives, so repeated frames are never reprocessed
         start = time.perf_counter()
         ret, frame = cap.read()
-        counters["read frame"] += time.perf_counter() - start
+        read = time.perf_counter() - start
+        counters["read frame"] += read
+        stage_metrics["read frame"].observe(read)
         if not ret:
             print("Failed to read frame")
             break
 
-        start = time.perf_counter()
         if iters % 1000 == 0:
-            bounds = find_bounds(frame)
-
             if last_check_time is not None:
                 delta = time.monotonic() - last_check_time
-                print(f"{iters} ({delta:.2f} sec per 1000 iter, approx. {1000/delta:.2f} fps), bounds: {bounds}")
+                # with workers the bounds live in their processes
+                print(f"{iters} ({delta:.2f} sec per 1000 iter, approx. {1000/delta:.2f} fps)"
+                      + (f", bounds: {analyzer.detector.bounds}" if not ANALYSIS_WORKERS else "")
+                      + (f", capture roi: {cap.roi}" if CAPTURE_ROI else "")
+                      + (f", quality level: {governor.level}" if governor is not None else ""))
             last_check_time = time.monotonic()
             sys.stdout.flush()
 
-        if bounds is not None:
-            before_bounds_shape = frame.shape
-            frame = apply_bounds(frame, bounds)
-            after_bounds_shape = frame.shape
-            if before_bounds_shape == after_bounds_shape:
-                bounds = None
-        counters["bounds"] += time.perf_counter() - start
-
-        # areas: [upper_left, upper_middle, upper_right, lower_left, lower_middle, lower_right]
-        areas = split(frame)
-
-        # run computation in threadpool
-        start = time.perf_counter()
-        dom_colors = np.zeros((len(areas), 3), dtype=np.uint64)
-        def process_area(i):
-            dom_colors[i] = mean_color(areas[i])
-        pool.map(process_area, range(len(areas)))
-        counters["processing mean"] += time.perf_counter() - start
-
-        # bgr to rgb
-        colors = [ [int(c[2]), int(c[1]), int(c[0])] for c in dom_colors]
-
-        start = time.perf_counter()
-        leds.show(colors)
-        counters["led io"] += time.perf_counter() - start
+        now = time.monotonic()
+        if now - fps_time >= 1:
+            fps_gauge.set((iters - fps_iters) / (now - fps_time))
+            fps_time = now
+            fps_iters = iters
+
+        if ANALYSIS_WORKERS:
+            if pool is None:
+                start_pool(analyzer, governor, max(SLOT_BYTES, frame.nbytes))
+            # copy into a free slot for the workers; their results are shown by the PoolOutput thread
+            slot = pool.acquire()
+            if slot is not None:
+                try:
+                    pool.submit(slot, frame, leds.get_brightness(), governor.settings if governor is not None else LEVELS[0])
+                except ValueError as e:
+                    print(f"Resolution grew past the analysis slots: {e}")
+                    break
+            cap.done()
+            colors = None
+        else:
+            colors = analyzer.analyze(frame, leds.get_brightness())
+            record_analysis(analyzer.skipped, analyzer.timings, analyzer.score, analyzer.cut)
+            # analysis is done with the frame, let the capture reuse its buffer
+            cap.done()
+        # and don't hold on to it, the capture may remap its buffers to crop
+        frame = None
+
+        if colors is not None:
+            if clock is not None:
+                clock.show(colors, analyzer.cut)
+            elif output is not None:
+                # hand off to the output thread, waiting only if both buffers are still in flight
+                buf = handoff.acquire()
+                buf[:] = colors
+                handoff.publish(buf)
+            else:
+                start = time.perf_counter()
+                leds.show(colors)
+                seconds = time.perf_counter() - start
+                counters["led io"] += seconds
+                stage_metrics["led io"].observe(seconds)
 
         iters += 1
+        frames_total.inc()
+
+        seconds = time.perf_counter() - iter_start
+        counters["iter"] += seconds
 
-        counters["iter"] += time.perf_counter() - iter_start
+        # waiting for the next frame isn't load, everything else is; with
+        # workers the governor is fed their analysis time instead
+        if governor is not None and not ANALYSIS_WORKERS and governor.update(seconds - read):
+            analyzer.configure(*governor.settings)
+            quality_gauge.set(governor.level)
+            print(f"Quality level {governor.level}: row stride, cadence, smoothing = {governor.settings}")
 
     cleanup()
 
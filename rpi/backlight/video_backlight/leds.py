@@ -1,60 +1,95 @@
-from rpi_ws281x import PixelStrip, Color
+import numpy as np
+from strips import open_strips, max_fps
+from color_transform import ColorTransform
 
 # LED strip configuration:
 LED_COUNT = 100        # Number of LED pixels.
-LED_PIN = 18          # GPIO pin connected to the pixels (18 uses PWM!).
-# LED_PIN = 10        # GPIO pin connected to the pixels (10 uses SPI /dev/spidev0.0).
+LED_PIN = 18          # GPIO pin connected to the pixels (18 uses PWM channel 0, 13 channel 1).
 LED_FREQ_HZ = 800000  # LED signal frequency in hertz (usually 800khz)
 LED_DMA = 10          # DMA channel to use for generating signal (try 10)
 LED_BRIGHTNESS = 255  # Set to 0 for darkest and 255 for brightest
 LED_INVERT = False    # True to invert the signal (when using NPN transistor level shift)
-LED_CHANNEL = 0       # set to '1' for GPIOs 13, 19, 41, 45 or 53
+LED_GAMMA = 2.2       # Captured colors are gamma encoded, the leds are linear (1 for no correction)
+LED_WHITE_BALANCE = (1.0, 1.0, 1.0)  # Red, green and blue gains (0-1) to make white look white
+LED_DITHER = False    # True to temporally dither away the steps gamma and low brightness leave
+# Strips making up the LED_COUNT leds below, in order (see strips.open_strips),
+# e.g. the bottom and right edges on one PWM channel, top and left on the other:
+# [{"type": "pwm", "count": 50, "pin": 18}, {"type": "pwm", "count": 50, "pin": 13}]
+# or {"type": "spi", "count": 100} for gpio 10 (/dev/spidev0.0).
+# Each strip is refreshed at the same time as the others
+STRIPS = [
+    {"type": "pwm", "count": LED_COUNT, "pin": LED_PIN},
+]
+# fastest the leds can be refreshed: 30us per led plus the 50us reset on the
+# longest strip, the same limit as audio_backlight.config._max_led_FPS
+LED_MAX_FPS = max_fps(max(strip["count"] for strip in STRIPS))
 
+# Strip layout around the tv, starting at the bottom left corner:
+LED_BOTTOM = 32       # 0-32, bottom edge from left to right
+LED_RIGHT = 18        # 32-50, right edge from bottom to top
+LED_TOP = 32          # 50-82, top edge from right to left
+LED_LEFT = 18         # 82-100, left edge from top to bottom
+
+# Zone shown by each led when given the six zone colors
+# [upper_left, upper_middle, upper_right, lower_left, lower_middle, lower_right]
+ZONE_RUNS = [
+    (10, 3),    # 0-10 lower_left
+    (22, 4),    # 10-22 lower_middle
+    (41, 5),    # 22-41 lower_right
+    (60, 2),    # 41-60 upper_right
+    (72, 1),    # 60-72 upper_middle
+    (91, 0),    # 72-91 upper_left
+    (100, 3),   # 91-100 lower_left
+]
+ZONE_INDEX = np.repeat([zone for _, zone in ZONE_RUNS], np.diff([0] + [end for end, _ in ZONE_RUNS]))
+
+# The leds around the tv, on one or more strips (a strips.StripManager, which
+# also takes care of color correction, brightness included, and of only
+# writing leds that changed).
 class DMALeds:
-    def __init__(self):
-        self.strip = PixelStrip(LED_COUNT, LED_PIN, LED_FREQ_HZ, LED_DMA, LED_INVERT, LED_BRIGHTNESS, LED_CHANNEL)
+    def __init__(self, strips=None):
+        if strips is None:
+            transform = ColorTransform(LED_GAMMA, LED_WHITE_BALANCE, dither=LED_DITHER)
+            strips = open_strips(STRIPS, LED_DMA, LED_FREQ_HZ, LED_BRIGHTNESS, LED_INVERT, transform)
+        if strips.count != LED_COUNT:
+            raise ValueError(f"STRIPS add up to {strips.count} leds, not LED_COUNT ({LED_COUNT})")
+        self.strip = strips
+        self.frame = np.zeros((LED_COUNT, 3), dtype=np.uint8)
 
     def start(self):
         self.strip.begin()
 
     def cleanup(self):
-        self.strip._cleanup()
+        self.strip.cleanup()
 
     def set_brightness(self, brightness):
-        self.strip.setBrightness(brightness)
+        self.strip.set_brightness(brightness)
 
     def get_brightness(self):
-        return self.strip.getBrightness()
+        return self.strip.get_brightness()
 
-    def show(self, colors):
-        colors = [Color(red=c[0], green=c[1], blue=c[2]) for c in colors]
-        # colors: [upper_left, upper_middle, upper_right, lower_left, lower_middle, lower_right]
-        upper_left, upper_middle, upper_right, lower_left, lower_middle, lower_right = colors
+    def set_calibration(self, gamma=None, white_balance=None, dither=None):
+        self.strip.set_calibration(gamma, white_balance, dither)
 
-        for i in range(100):
-            if i < 10:
-                color = lower_left # 0-10
-            elif i < 22:
-                color = lower_middle # 10-22
-            elif i < 41:
-                color = lower_right # 22-41
-            elif i < 60:
-                color = upper_right  # 41-60
-            elif i < 72:
-                color = upper_middle # 60-72
-            elif i < 91:
-                color = upper_left # 72-91
-            else:
-                color = lower_left # 91-100
-            self.strip.setPixelColor(i, color)
+    def get_calibration(self):
+        return self.strip.get_calibration()
 
-        self.strip.show()
+    # colors: (N, 3) rgb, either one per led in strip order or the six zone colors
+    def show(self, colors):
+        colors = np.asarray(colors, dtype=np.uint8)
+        if len(colors) != LED_COUNT:
+            # spread zones out over their leds
+            np.take(colors, ZONE_INDEX, axis=0, out=self.frame)
+        else:
+            np.copyto(self.frame, colors)
+        self.strip.write(self.frame)
 
 
 if __name__ == "__main__":
     import time
     import random
     leds = DMALeds()
+    leds.start()
     colors = [
         [255,0,0], # upper_left
         [255,0,255], # upper_middle
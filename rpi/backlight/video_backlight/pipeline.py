@@ -0,0 +1,88 @@
+import time
+import queue
+import threading
+import numpy as np
+
+
+# Bounded handoff between two pipeline stages using a fixed set of
+# preallocated buffers (two by default, i.e. double buffering). The producer
+# `acquire`s a free buffer, fills it and `publish`es it; the consumer `take`s
+# it and `recycle`s it when done. With every buffer in flight the producer
+# waits, which is counted as stall time.
+class Handoff:
+
+    def __init__(self, shape, dtype=np.uint8, depth=2):
+        self.depth = depth
+        self.free = queue.Queue()
+        self.filled = queue.Queue()
+        for _ in range(depth):
+            self.free.put(np.zeros(shape, dtype=dtype))
+        self.stall = 0
+        self.starve = 0
+        self.depth_total = 0
+        self.published = 0
+
+    def acquire(self):
+        start = time.perf_counter()
+        buf = self.free.get()
+        self.stall += time.perf_counter() - start
+        return buf
+
+    def publish(self, buf):
+        self.filled.put(buf)
+        self.depth_total += self.filled.qsize()
+        self.published += 1
+
+    def take(self, timeout=None):
+        start = time.perf_counter()
+        try:
+            buf = self.filled.get(timeout=timeout)
+        except queue.Empty:
+            buf = None
+        self.starve += time.perf_counter() - start
+        return buf
+
+    def recycle(self, buf):
+        self.free.put(buf)
+
+    def mean_depth(self):
+        return self.depth_total / self.published if self.published else 0
+
+
+# Output stage of the pipelined video mode: owns the LEDs and shows colors
+# published by the analysis stage from its own thread, so the DMA transfer of
+# frame N overlaps the analysis of frame N+1.
+class OutputStage:
+
+    def __init__(self, leds, handoff, counters, led_io=None):
+        self.leds = leds
+        self.handoff = handoff
+        self.counters = counters
+        # optional metrics histogram for the show() time
+        self.led_io = led_io
+        self.running = False
+        self.t = threading.Thread(target=self._writer)
+        self.t.daemon = True
+
+    def start(self):
+        self.running = True
+        self.t.start()
+
+    def _writer(self):
+        while self.running:
+            colors = self.handoff.take(timeout=0.1)
+            if colors is None:
+                continue
+            start = time.perf_counter()
+            self.leds.show(colors)
+            seconds = time.perf_counter() - start
+            self.counters["led io"] += seconds
+            if self.led_io is not None:
+                self.led_io.observe(seconds)
+            self.handoff.recycle(colors)
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self.t.join()
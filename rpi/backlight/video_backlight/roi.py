@@ -0,0 +1,107 @@
+import time
+from .bounds import BoundsDetector, BLACK_THRESHOLD
+
+# seconds between looks at the full frame while the driver crops the
+# letterbox off, to notice the bars going away; each look restarts the
+# stream twice
+PROBE_INTERVAL = 10
+
+
+# Pushes the letterbox crop down into the capture, so the bars cost nothing
+# past the capture itself: no ring copy, static check or sampling over them.
+#
+# Bounds are tracked on full frames with the same hysteresis the analysis
+# uses (a BoundsDetector, scanning a few rows and columns). Once they settle
+# on a letterbox, a capture that can crop in the driver (`set_crop`, see
+# V4L2Capture) is asked to deliver only the picture, and a full frame is
+# looked at again every probe_interval seconds. Any other capture keeps
+# delivering full frames and `read` hands out the picture as a view.
+# Crop changes are made at the start of the next `read`, once the caller is
+# done with the previous frame.
+#
+# With yuyv frames the bounds are found on luma and widened to whole
+# macropixels, like yuv.apply_bounds.
+class ROICapture:
+
+    def __init__(self, cap, threshold=BLACK_THRESHOLD, yuyv=False, probe_interval=PROBE_INTERVAL):
+        self.cap = cap
+        self.detector = BoundsDetector(threshold)
+        self.yuyv = yuyv
+        self.probe_interval = probe_interval
+        # part of the full frame handed out ([top, bottom, left, right]) or
+        # None for all of it, and the part it should be
+        self.roi = None
+        self.wanted = None
+        # whether the capture itself is cropping to roi
+        self.hardware = False
+        self.can_crop = True
+        self.probe_time = 0
+        self.full_shape = None
+        self.crops = 0
+
+    def is_opened(self):
+        return self.cap.is_opened()
+
+    def start(self):
+        self.cap.start()
+
+    def read(self, timeout=3):
+        if self.hardware and time.monotonic() - self.probe_time >= self.probe_interval:
+            # back to full frames until the bounds settle again
+            self.wanted = None
+        if self.wanted != self.roi:
+            self._crop(self.wanted)
+
+        ret, frame = self.cap.read(timeout)
+        if not ret or self.hardware:
+            return ret, frame
+
+        self.full_shape = frame.shape
+        height, width = frame.shape[:2]
+        bounds = self.detector.update(frame[:, :, :1] if self.yuyv else frame)
+        if self.detector.candidate is None:
+            if bounds == [0, height - 1, 0, width - 1]:
+                self.wanted = None
+            elif self.yuyv:
+                self.wanted = [bounds[0], bounds[1], bounds[2] & ~1, bounds[3] | 1]
+            else:
+                self.wanted = list(bounds)
+        roi = self.roi
+        if roi is None:
+            return ret, frame
+        return ret, frame[roi[0]:roi[1]+1, roi[2]:roi[3]+1]
+
+    def _crop(self, roi):
+        self.hardware = False
+        if self.can_crop:
+            if self.cap.set_crop(roi):
+                self.crops += 1
+                self.probe_time = time.monotonic()
+                # the driver may have rounded the rectangle, whatever it
+                # left in is for the analysis' own bounds detection
+                roi = self.cap.crop
+                self.hardware = roi is not None
+            elif roi is not None:
+                # it can't, don't restart the stream for nothing again
+                self.can_crop = False
+        self.roi = roi
+        self.wanted = roi
+
+    # fraction of the full frame that's handed out
+    def fraction(self):
+        if self.roi is None or self.full_shape is None:
+            return 1.0
+        top, bottom, left, right = self.roi
+        return (bottom - top + 1) * (right - left + 1) / (self.full_shape[0] * self.full_shape[1])
+
+    def done(self):
+        self.cap.done()
+
+    def stats(self):
+        return self.cap.stats()
+
+    def yuv_encoding(self):
+        return self.cap.yuv_encoding()
+
+    def release(self):
+        self.cap.release()
@@ -0,0 +1,31 @@
+import numpy as np
+
+# scene change score above which a frame counts as a hard cut, see below, per
+# sampling mode: the fewer pixels each sampled color stands for, the more the
+# colors move with the picture. Dominant colors are scored on the zone means
+# (see DominantSampler.scene_colors), like zones. Tuned on pans and cuts of
+# smooth pictures (the benchmark's scene cut check, 40 seeds): pans score up
+# to about 0.016 / 0.047 / 0.016, cuts from about 0.054 / 0.17 / 0.054 up
+CUT_THRESHOLDS = {"zones": 0.04, "edges": 0.1, "dominant": 0.04}
+CUT_THRESHOLD = CUT_THRESHOLDS["zones"]
+
+
+# Scores how much the picture changed from the sampled colors alone, no
+# extra pass over the frame: the mean absolute difference between this
+# frame's zone colors and the previous ones, over all zones and channels,
+# as a fraction of full scale. Motion or a fade moves a few zones a little,
+# a cut moves most of them a lot.
+class SceneCutDetector:
+
+    def __init__(self, threshold=CUT_THRESHOLD):
+        self.threshold = threshold
+        self.score = 0.0
+
+    # previous: the last sampled colors (or None), colors: the new ones;
+    # returns True on a cut
+    def update(self, previous, colors):
+        if previous is None or previous.shape != colors.shape:
+            self.score = 0.0
+            return False
+        self.score = float(np.abs(colors - previous).mean()) / 255
+        return self.threshold is not None and self.score > self.threshold
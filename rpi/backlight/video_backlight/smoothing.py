@@ -0,0 +1,42 @@
+import numpy as np
+
+
+# Exponential moving average over the sampled colors, roughly averaging the
+# last `window` targets (alpha = 2 / (window + 1)). A window of 1 passes
+# colors straight through. Once the output is within half a level of the
+# target it snaps onto it and counts as settled, so a still picture stops
+# costing led writes after a few frames.
+class ColorSmoother:
+
+    def __init__(self, window=1):
+        self.set_window(window)
+        self.reset()
+
+    def set_window(self, window):
+        self.window = window
+        self.alpha = 2 / (window + 1)
+
+    def reset(self):
+        self.target = None
+        self.value = None
+        self.settled = True
+
+    # new sampled colors to move towards, returns the smoothed colors
+    def update(self, colors):
+        if self.target is None or self.target.shape != colors.shape:
+            self.target = colors.astype(np.float32)
+            self.value = self.target.copy()
+            self.colors = np.empty(colors.shape, dtype=np.uint8)
+        else:
+            self.target[:] = colors
+        return self.step()
+
+    # one more step towards the current target, for frames that weren't sampled
+    def step(self):
+        if self.alpha < 1:
+            self.value += self.alpha * (self.target - self.value)
+        self.settled = self.alpha >= 1 or np.abs(self.target - self.value).max() < 0.5
+        if self.settled:
+            self.value[:] = self.target
+        self.colors[:] = np.rint(self.value)
+        return self.colors
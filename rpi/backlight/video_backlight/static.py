@@ -0,0 +1,42 @@
+import numpy as np
+
+# only every STRIDE'th row and column of the frame is compared
+STRIDE = 16
+# per-channel difference that counts as movement rather than capture noise
+DIFF_THRESHOLD = 12
+# fraction of sampled pixels that have to move for the frame to count as changed
+MIN_CHANGED = 0.002
+
+
+# Cheap "did the picture change" check: a sparse grid of pixels is compared
+# against the grid from the last frame that counted as changed. The reference
+# is only updated on change, so slow fades still add up past the threshold
+# instead of slipping through one small step at a time.
+class ChangeDetector:
+
+    def __init__(self, stride=STRIDE, threshold=DIFF_THRESHOLD, min_changed=MIN_CHANGED):
+        self.stride = stride
+        self.threshold = threshold
+        self.min_changed = min_changed
+        self.reference = None
+
+    def reset(self):
+        self.reference = None
+
+    def changed(self, frame):
+        sample = frame[::self.stride, ::self.stride]
+        if self.reference is None or self.reference.shape != sample.shape:
+            self.reference = sample.astype(np.int16)
+            self.diff = np.empty(sample.shape, dtype=np.int16)
+            self.moved = np.empty(sample.shape, dtype=bool)
+            return True
+
+        np.subtract(sample, self.reference, out=self.diff)
+        np.abs(self.diff, out=self.diff)
+        np.greater(self.diff, self.threshold, out=self.moved)
+        moved_pixels = np.count_nonzero(self.moved.any(axis=2))
+        if moved_pixels <= self.min_changed * sample.shape[0] * sample.shape[1]:
+            return False
+
+        np.copyto(self.reference, sample)
+        return True
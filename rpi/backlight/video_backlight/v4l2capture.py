@@ -0,0 +1,678 @@
+import ctypes
+import errno
+import fcntl
+import mmap
+import os
+import select
+import time
+import numpy as np
+
+# Minimal V4L2 bindings, just enough for streaming capture through mmap'd
+# driver buffers. Struct layouts follow linux/videodev2.h; ioctl numbers are
+# derived from the ctypes struct sizes so they're right on both 32 and 64 bit.
+
+_IOC_WRITE = 1
+_IOC_READ = 2
+
+def _ioc(direction, nr, struct):
+    return (direction << 30) | (ctypes.sizeof(struct) << 16) | (ord("V") << 8) | nr
+
+def fourcc(code):
+    return code[0] | (code[1] << 8) | (code[2] << 16) | (code[3] << 24)
+
+PIX_FMT_BGR24 = fourcc(b"BGR3")
+PIX_FMT_YUYV = fourcc(b"YUYV")
+
+V4L2_BUF_TYPE_VIDEO_CAPTURE = 1
+V4L2_MEMORY_MMAP = 1
+V4L2_FIELD_ANY = 0
+V4L2_CAP_VIDEO_CAPTURE = 0x00000001
+V4L2_CAP_STREAMING = 0x04000000
+V4L2_COLORSPACE_REC709 = 3
+V4L2_COLORSPACE_JPEG = 7
+V4L2_YCBCR_ENC_DEFAULT = 0
+V4L2_YCBCR_ENC_601 = 1
+V4L2_YCBCR_ENC_709 = 2
+V4L2_QUANTIZATION_DEFAULT = 0
+V4L2_QUANTIZATION_FULL_RANGE = 1
+V4L2_SEL_TGT_CROP = 0x0000
+
+
+class v4l2_capability(ctypes.Structure):
+    _fields_ = [
+        ("driver", ctypes.c_char * 16),
+        ("card", ctypes.c_char * 32),
+        ("bus_info", ctypes.c_char * 32),
+        ("version", ctypes.c_uint32),
+        ("capabilities", ctypes.c_uint32),
+        ("device_caps", ctypes.c_uint32),
+        ("reserved", ctypes.c_uint32 * 3),
+    ]
+
+class v4l2_pix_format(ctypes.Structure):
+    _fields_ = [
+        ("width", ctypes.c_uint32),
+        ("height", ctypes.c_uint32),
+        ("pixelformat", ctypes.c_uint32),
+        ("field", ctypes.c_uint32),
+        ("bytesperline", ctypes.c_uint32),
+        ("sizeimage", ctypes.c_uint32),
+        ("colorspace", ctypes.c_uint32),
+        ("priv", ctypes.c_uint32),
+        ("flags", ctypes.c_uint32),
+        ("ycbcr_enc", ctypes.c_uint32),
+        ("quantization", ctypes.c_uint32),
+        ("xfer_func", ctypes.c_uint32),
+    ]
+
+class _v4l2_format_fmt(ctypes.Union):
+    _fields_ = [
+        ("pix", v4l2_pix_format),
+        ("raw_data", ctypes.c_uint8 * 200),
+        # struct v4l2_window in the kernel union contains pointers
+        ("_align", ctypes.c_void_p),
+    ]
+
+class v4l2_format(ctypes.Structure):
+    _fields_ = [
+        ("type", ctypes.c_uint32),
+        ("fmt", _v4l2_format_fmt),
+    ]
+
+class v4l2_rect(ctypes.Structure):
+    _fields_ = [
+        ("left", ctypes.c_int32),
+        ("top", ctypes.c_int32),
+        ("width", ctypes.c_uint32),
+        ("height", ctypes.c_uint32),
+    ]
+
+class v4l2_selection(ctypes.Structure):
+    _fields_ = [
+        ("type", ctypes.c_uint32),
+        ("target", ctypes.c_uint32),
+        ("flags", ctypes.c_uint32),
+        ("r", v4l2_rect),
+        ("reserved", ctypes.c_uint32 * 9),
+    ]
+
+class v4l2_requestbuffers(ctypes.Structure):
+    _fields_ = [
+        ("count", ctypes.c_uint32),
+        ("type", ctypes.c_uint32),
+        ("memory", ctypes.c_uint32),
+        ("capabilities", ctypes.c_uint32),
+        ("reserved", ctypes.c_uint32 * 1),
+    ]
+
+class timeval(ctypes.Structure):
+    _fields_ = [
+        ("tv_sec", ctypes.c_long),
+        ("tv_usec", ctypes.c_long),
+    ]
+
+class v4l2_timecode(ctypes.Structure):
+    _fields_ = [
+        ("type", ctypes.c_uint32),
+        ("flags", ctypes.c_uint32),
+        ("frames", ctypes.c_uint8),
+        ("seconds", ctypes.c_uint8),
+        ("minutes", ctypes.c_uint8),
+        ("hours", ctypes.c_uint8),
+        ("userbits", ctypes.c_uint8 * 4),
+    ]
+
+class _v4l2_buffer_m(ctypes.Union):
+    _fields_ = [
+        ("offset", ctypes.c_uint32),
+        ("userptr", ctypes.c_ulong),
+        ("planes", ctypes.c_void_p),
+        ("fd", ctypes.c_int32),
+    ]
+
+class v4l2_buffer(ctypes.Structure):
+    _fields_ = [
+        ("index", ctypes.c_uint32),
+        ("type", ctypes.c_uint32),
+        ("bytesused", ctypes.c_uint32),
+        ("flags", ctypes.c_uint32),
+        ("field", ctypes.c_uint32),
+        ("timestamp", timeval),
+        ("timecode", v4l2_timecode),
+        ("sequence", ctypes.c_uint32),
+        ("memory", ctypes.c_uint32),
+        ("m", _v4l2_buffer_m),
+        ("length", ctypes.c_uint32),
+        ("reserved2", ctypes.c_uint32),
+        ("request_fd", ctypes.c_int32),
+    ]
+
+VIDIOC_QUERYCAP = _ioc(_IOC_READ, 0, v4l2_capability)
+VIDIOC_G_FMT = _ioc(_IOC_READ | _IOC_WRITE, 4, v4l2_format)
+VIDIOC_S_FMT = _ioc(_IOC_READ | _IOC_WRITE, 5, v4l2_format)
+VIDIOC_REQBUFS = _ioc(_IOC_READ | _IOC_WRITE, 8, v4l2_requestbuffers)
+VIDIOC_QUERYBUF = _ioc(_IOC_READ | _IOC_WRITE, 9, v4l2_buffer)
+VIDIOC_QBUF = _ioc(_IOC_READ | _IOC_WRITE, 15, v4l2_buffer)
+VIDIOC_DQBUF = _ioc(_IOC_READ | _IOC_WRITE, 17, v4l2_buffer)
+VIDIOC_STREAMON = _ioc(_IOC_WRITE, 18, ctypes.c_int)
+VIDIOC_STREAMOFF = _ioc(_IOC_WRITE, 19, ctypes.c_int)
+VIDIOC_G_SELECTION = _ioc(_IOC_READ | _IOC_WRITE, 94, v4l2_selection)
+VIDIOC_S_SELECTION = _ioc(_IOC_READ | _IOC_WRITE, 95, v4l2_selection)
+
+# bytes per pixel of the packed formats we know how to view
+_PIXEL_SIZES = {
+    PIX_FMT_BGR24: 3,
+    PIX_FMT_YUYV: 2,
+}
+
+
+# The system calls V4L2Capture makes on its device, kept behind one object so
+# a FakeDriver can stand in for the kernel
+class DeviceIO:
+
+    def open(self, path):
+        return os.open(path, os.O_RDWR | os.O_NONBLOCK)
+
+    def ioctl(self, fd, request, arg):
+        return fcntl.ioctl(fd, request, arg)
+
+    def mmap(self, fd, length, offset):
+        return mmap.mmap(fd, length, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE, offset=offset)
+
+    # True once a buffer is ready to dequeue, False after timeout seconds
+    def wait(self, fd, timeout):
+        ready, _, _ = select.select([fd], [], [], timeout)
+        return bool(ready)
+
+    def close(self, fd):
+        os.close(fd)
+
+
+# Capture straight from /dev/videoN through mmap'd V4L2 buffers. `read` hands
+# out the newest filled buffer as a numpy view over driver memory (no copy);
+# the caller calls `done` once it's finished with the frame so the buffer can
+# be queued back to the driver. Works with any streaming capture driver,
+# including v4l2loopback, so it can be exercised without a capture card.
+#
+# Drivers that support cropping can be asked to capture only part of the
+# picture with `set_crop`, see roi.py.
+#
+# `io` makes the system calls, a DeviceIO unless given (a FakeDriver in the
+# benchmark); run this file to check a real device (see the end of it).
+class V4L2Capture:
+
+    def __init__(self, device="/dev/video0", width=None, height=None, pixelformat=PIX_FMT_BGR24, buffer_count=4, io=None):
+        self.device = device
+        self.io = io if io is not None else DeviceIO()
+        self.fd = None
+        self.maps = []
+        self.frames = []
+        self.current = None
+        self.streaming = False
+        # sequence number of the last frame returned by read
+        self.seq = 0
+        self.captured = 0
+        self.consumed = 0
+        self.dropped = 0
+        # sequence number of the last frame dequeued, None at the start of
+        # a stream (drivers may start anywhere, or back at 0)
+        self.last_sequence = None
+        # the driver's crop rectangle when opened, the full frame, as [top,
+        # bottom, left, right]; None if it can't crop. `crop` is the part of
+        # the full frame currently captured, None for all of it
+        self.crop_bounds = None
+        self.crop = None
+        try:
+            self._open(width, height, pixelformat, buffer_count)
+        except OSError as e:
+            print(f"Unable to open {device}: {e}")
+            self._close()
+
+    def _ioctl(self, request, arg):
+        return self.io.ioctl(self.fd, request, arg)
+
+    def _open(self, width, height, pixelformat, buffer_count):
+        self.fd = self.io.open(self.device)
+
+        cap = v4l2_capability()
+        self._ioctl(VIDIOC_QUERYCAP, cap)
+        caps = cap.device_caps or cap.capabilities
+        if not caps & V4L2_CAP_VIDEO_CAPTURE or not caps & V4L2_CAP_STREAMING:
+            raise OSError(errno.ENODEV, "not a streaming capture device")
+
+        fmt = v4l2_format(type=V4L2_BUF_TYPE_VIDEO_CAPTURE)
+        self._ioctl(VIDIOC_G_FMT, fmt)
+        if width is not None and height is not None:
+            fmt.fmt.pix.width = width
+            fmt.fmt.pix.height = height
+        fmt.fmt.pix.pixelformat = pixelformat
+        fmt.fmt.pix.field = V4L2_FIELD_ANY
+        self._ioctl(VIDIOC_S_FMT, fmt)
+
+        # the driver may have adjusted any of these
+        self.width = fmt.fmt.pix.width
+        self.height = fmt.fmt.pix.height
+        self.pixelformat = fmt.fmt.pix.pixelformat
+        self.bytesperline = fmt.fmt.pix.bytesperline
+        self.colorspace = fmt.fmt.pix.colorspace
+        self.ycbcr_enc = fmt.fmt.pix.ycbcr_enc
+        self.quantization = fmt.fmt.pix.quantization
+        if self.pixelformat != pixelformat or self.pixelformat not in _PIXEL_SIZES:
+            # the analysis has to know what it's looking at, don't take a substitute
+            raise OSError(errno.EINVAL, f"unsupported pixel format {self.pixelformat.to_bytes(4, 'little')}")
+        if self.bytesperline == 0:
+            self.bytesperline = self.width * _PIXEL_SIZES[self.pixelformat]
+
+        sel = v4l2_selection(type=V4L2_BUF_TYPE_VIDEO_CAPTURE, target=V4L2_SEL_TGT_CROP)
+        try:
+            self._ioctl(VIDIOC_G_SELECTION, sel)
+        except OSError:
+            pass
+        else:
+            r = sel.r
+            self.crop_bounds = [r.top, r.top + r.height - 1, r.left, r.left + r.width - 1]
+
+        self.buffer_count = buffer_count
+        self._map_buffers()
+
+    def _map_buffers(self):
+        pixel_size = _PIXEL_SIZES[self.pixelformat]
+        req = v4l2_requestbuffers(count=self.buffer_count, type=V4L2_BUF_TYPE_VIDEO_CAPTURE, memory=V4L2_MEMORY_MMAP)
+        self._ioctl(VIDIOC_REQBUFS, req)
+        if req.count < 2:
+            raise OSError(errno.ENOMEM, "driver granted fewer than 2 buffers")
+
+        for i in range(req.count):
+            buf = v4l2_buffer(index=i, type=V4L2_BUF_TYPE_VIDEO_CAPTURE, memory=V4L2_MEMORY_MMAP)
+            self._ioctl(VIDIOC_QUERYBUF, buf)
+            m = self.io.mmap(self.fd, buf.length, buf.m.offset)
+            # through frombuffer, which holds an export on the map for as long
+            # as any view of it lives, so the map can't be closed under a
+            # frame (ndarray(buffer=m) alone doesn't hold one)
+            frame = np.ndarray((self.height, self.width, pixel_size), dtype=np.uint8, buffer=np.frombuffer(m, dtype=np.uint8),
+                               strides=(self.bytesperline, pixel_size, 1))
+            frame.flags.writeable = False
+            self.maps.append(m)
+            self.frames.append(frame)
+
+    def _unmap_buffers(self):
+        # views must be dropped before their mmaps can be closed
+        self.frames = []
+        for m in self.maps:
+            try:
+                m.close()
+            except BufferError:
+                # a frame from read is still referenced, as when cleanup runs
+                # from a signal handler mid-frame; the map is unmapped once
+                # that view goes away
+                pass
+        self.maps = []
+
+    def _select(self, rect):
+        # asks for a crop rectangle in the driver's coordinates, returns what it granted
+        sel = v4l2_selection(type=V4L2_BUF_TYPE_VIDEO_CAPTURE, target=V4L2_SEL_TGT_CROP,
+                             r=v4l2_rect(left=rect[2], top=rect[0], width=rect[3] - rect[2] + 1, height=rect[1] - rect[0] + 1))
+        self._ioctl(VIDIOC_S_SELECTION, sel)
+        r = sel.r
+        return [r.top, r.top + r.height - 1, r.left, r.left + r.width - 1]
+
+    # Captures only `rect` of the full frame ([top, bottom, left, right], as
+    # find_bounds gives them) from now on, or all of it for None. Frames
+    # change size, so the stream is stopped and its buffers mapped anew:
+    # this costs a few frames, it's for bounds that rarely change. No frame
+    # from `read` may still be referenced, their buffers are unmapped.
+    # Returns False if the driver can't crop, or would scale the crop back
+    # up to the old frame size; the full frame is captured then.
+    def set_crop(self, rect):
+        if self.crop_bounds is None:
+            return False
+        top, _, left, _ = self.crop_bounds
+        rect = [rect[0] + top, rect[1] + top, rect[2] + left, rect[3] + left] if rect is not None else self.crop_bounds
+        streaming = self.streaming
+        if streaming:
+            self._ioctl(VIDIOC_STREAMOFF, ctypes.c_int(V4L2_BUF_TYPE_VIDEO_CAPTURE))
+            self.streaming = False
+        self.current = None
+        self._unmap_buffers()
+        self._ioctl(VIDIOC_REQBUFS, v4l2_requestbuffers(count=0, type=V4L2_BUF_TYPE_VIDEO_CAPTURE, memory=V4L2_MEMORY_MMAP))
+
+        fmt = v4l2_format(type=V4L2_BUF_TYPE_VIDEO_CAPTURE)
+        try:
+            granted = self._select(rect)
+            self._ioctl(VIDIOC_G_FMT, fmt)
+            cropped = (fmt.fmt.pix.height, fmt.fmt.pix.width) == (granted[1] - granted[0] + 1, granted[3] - granted[2] + 1)
+        except OSError as e:
+            print(f"Unable to crop {self.device} to {rect}: {e}")
+            cropped = False
+        if not cropped:
+            # no crop, or a scaler: the bandwidth stays the same and the frame
+            # would no longer map 1:1 onto the picture
+            granted = self.crop_bounds
+            try:
+                self._select(granted)
+            except OSError:
+                pass
+            self._ioctl(VIDIOC_G_FMT, fmt)
+        self.width = fmt.fmt.pix.width
+        self.height = fmt.fmt.pix.height
+        self.bytesperline = fmt.fmt.pix.bytesperline or self.width * _PIXEL_SIZES[self.pixelformat]
+        # back in full frame coordinates
+        self.crop = None if granted == self.crop_bounds else [granted[0] - top, granted[1] - top, granted[2] - left, granted[3] - left]
+
+        self._map_buffers()
+        if streaming:
+            self.start()
+        return cropped
+
+    def _queue(self, index):
+        buf = v4l2_buffer(index=index, type=V4L2_BUF_TYPE_VIDEO_CAPTURE, memory=V4L2_MEMORY_MMAP)
+        self._ioctl(VIDIOC_QBUF, buf)
+
+    def _dequeue(self):
+        buf = v4l2_buffer(type=V4L2_BUF_TYPE_VIDEO_CAPTURE, memory=V4L2_MEMORY_MMAP)
+        try:
+            self._ioctl(VIDIOC_DQBUF, buf)
+        except BlockingIOError:
+            return None
+        return buf
+
+    def is_opened(self):
+        return self.fd is not None
+
+    def start(self):
+        for i in range(len(self.frames)):
+            self._queue(i)
+        self._ioctl(VIDIOC_STREAMON, ctypes.c_int(V4L2_BUF_TYPE_VIDEO_CAPTURE))
+        self.streaming = True
+        self.last_sequence = None
+
+    def read(self, timeout=3):
+        if self.fd is None or not self.streaming:
+            return False, None
+        # a frame still held from the previous read goes back to the driver
+        self.done()
+
+        deadline = time.monotonic() + timeout
+        newest = None
+        while newest is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False, None
+            if not self.io.wait(self.fd, remaining):
+                return False, None
+            # drain everything that's filled, keeping only the most recent
+            while True:
+                buf = self._dequeue()
+                if buf is None:
+                    break
+                self._count(buf)
+                if newest is not None:
+                    self._queue(newest.index)
+                    self.dropped += 1
+                newest = buf
+
+        self.current = newest.index
+        self.seq = newest.sequence
+        self.consumed += 1
+        return True, self.frames[newest.index]
+
+    def _count(self, buf):
+        self.captured += 1
+        if self.last_sequence is not None and buf.sequence > self.last_sequence + 1:
+            # the driver had no free buffer to fill and skipped these frames
+            missed = buf.sequence - self.last_sequence - 1
+            self.captured += missed
+            self.dropped += missed
+        self.last_sequence = buf.sequence
+
+    def done(self):
+        if self.current is not None:
+            self._queue(self.current)
+            self.current = None
+
+    def stats(self):
+        return {"captured": self.captured, "consumed": self.consumed, "dropped": self.dropped}
+
+    # (encoding, full_range) of YUYV frames, see yuv.YUVSampler; "default"
+    # values resolve from the colorspace the way videodev2.h describes
+    def yuv_encoding(self):
+        enc = self.ycbcr_enc
+        if enc == V4L2_YCBCR_ENC_DEFAULT:
+            enc = V4L2_YCBCR_ENC_709 if self.colorspace == V4L2_COLORSPACE_REC709 else V4L2_YCBCR_ENC_601
+        quantization = self.quantization
+        if quantization == V4L2_QUANTIZATION_DEFAULT:
+            full_range = self.colorspace == V4L2_COLORSPACE_JPEG
+        else:
+            full_range = quantization == V4L2_QUANTIZATION_FULL_RANGE
+        return ("bt709" if enc == V4L2_YCBCR_ENC_709 else "bt601"), full_range
+
+    def release(self):
+        if self.fd is None:
+            return
+        if self.streaming:
+            try:
+                self._ioctl(VIDIOC_STREAMOFF, ctypes.c_int(V4L2_BUF_TYPE_VIDEO_CAPTURE))
+            except OSError:
+                pass
+            self.streaming = False
+        self.current = None
+        self._close()
+
+    def _close(self):
+        self._unmap_buffers()
+        if self.fd is not None:
+            self.io.close(self.fd)
+            self.fd = None
+
+
+# Stands in for a streaming capture driver behind V4L2Capture, delivering
+# `pictures` (full frames, cycled) through anonymous mmaps. Each wait
+# captures one to five frames into queued buffers and skips those that find
+# none, like a driver the reader can't keep up with, from a fixed seed. Rows
+# are padded, the crop rectangle can be set while no buffers are allocated,
+# and with `scales` the driver scales the crop back up to the full frame.
+class FakeDriver:
+
+    ROW_PADDING = 64
+
+    def __init__(self, pictures, pixelformat=PIX_FMT_BGR24, scales=False, seed=0):
+        self.pictures = pictures
+        self.pixelformat = pixelformat
+        self.scales = scales
+        self.rng = np.random.default_rng(seed)
+        height, width = pictures[0].shape[:2]
+        self.bounds = [0, height - 1, 0, width - 1]
+        self.rect = self.bounds
+        self.maps = []
+        self.queued = []
+        self.filled = []
+        self.streaming = False
+        self.sequence = 0
+        self.produced = 0
+        # picture number and crop rectangle each buffer was last filled from
+        self.contents = {}
+        self.skipped = 0
+        # frames from the first to the last one dequeued in each stream, what
+        # V4L2Capture can count as captured
+        self.observable = 0
+        self.first = self.last = None
+
+    def open(self, path):
+        return 3
+
+    def close(self, fd):
+        pass
+
+    def _shape(self):
+        top, bottom, left, right = self.bounds if self.scales else self.rect
+        return bottom - top + 1, right - left + 1
+
+    def _bytesperline(self):
+        return self._shape()[1] * _PIXEL_SIZES[self.pixelformat] + self.ROW_PADDING
+
+    def _length(self):
+        return self._bytesperline() * self._shape()[0]
+
+    def ioctl(self, fd, request, arg):
+        if request == VIDIOC_QUERYCAP:
+            arg.capabilities = arg.device_caps = V4L2_CAP_VIDEO_CAPTURE | V4L2_CAP_STREAMING
+        elif request in (VIDIOC_G_FMT, VIDIOC_S_FMT):
+            if request == VIDIOC_S_FMT and arg.fmt.pix.pixelformat in _PIXEL_SIZES:
+                self.pixelformat = arg.fmt.pix.pixelformat
+            pix = arg.fmt.pix
+            pix.height, pix.width = self._shape()
+            pix.pixelformat = self.pixelformat
+            pix.bytesperline = self._bytesperline()
+            pix.sizeimage = self._length()
+        elif request == VIDIOC_G_SELECTION:
+            self._set_rect(arg.r, self.rect)
+        elif request == VIDIOC_S_SELECTION:
+            if self.maps:
+                raise OSError(errno.EBUSY, "buffers allocated")
+            r = arg.r
+            top, bottom, left, right = self.bounds
+            self.rect = [max(r.top, top), min(r.top + r.height - 1, bottom), max(r.left, left), min(r.left + r.width - 1, right)]
+            self._set_rect(arg.r, self.rect)
+        elif request == VIDIOC_REQBUFS:
+            if self.streaming:
+                raise OSError(errno.EBUSY, "streaming")
+            arg.count = min(arg.count, 8)
+            self.maps = [None] * arg.count
+        elif request == VIDIOC_QUERYBUF:
+            arg.length = self._length()
+            arg.m.offset = arg.index * -(-self._length() // mmap.PAGESIZE) * mmap.PAGESIZE
+        elif request == VIDIOC_QBUF:
+            if arg.index in self.queued or arg.index in [index for index, _ in self.filled]:
+                raise OSError(errno.EINVAL, f"buffer {arg.index} already queued")
+            self.queued.append(arg.index)
+        elif request == VIDIOC_DQBUF:
+            if not self.filled:
+                raise BlockingIOError(errno.EAGAIN, "no buffer filled")
+            arg.index, arg.sequence = self.filled.pop(0)
+            arg.bytesused = self._length()
+            if self.first is None:
+                self.first = arg.sequence
+            self.last = arg.sequence
+        elif request == VIDIOC_STREAMON:
+            self.streaming = True
+            self.sequence = 0
+        elif request == VIDIOC_STREAMOFF:
+            self.streaming = False
+            self.queued, self.filled = [], []
+            if self.first is not None:
+                self.observable += self.last - self.first + 1
+            self.first = None
+        else:
+            raise OSError(errno.ENOTTY, f"unexpected ioctl {request:#x}")
+        return 0
+
+    def _set_rect(self, r, rect):
+        r.top, r.left = rect[0], rect[2]
+        r.height, r.width = rect[1] - rect[0] + 1, rect[3] - rect[2] + 1
+
+    def mmap(self, fd, length, offset):
+        index = offset // (-(-self._length() // mmap.PAGESIZE) * mmap.PAGESIZE)
+        self.maps[index] = mmap.mmap(-1, length)
+        return self.maps[index]
+
+    def wait(self, fd, timeout):
+        if not self.streaming:
+            return False
+        for _ in range(self.rng.integers(1, 6)):
+            if self.queued:
+                index = self.queued.pop(0)
+                height, width = self._shape()
+                pixel_size = _PIXEL_SIZES[self.pixelformat]
+                frame = np.ndarray((height, width, pixel_size), dtype=np.uint8, buffer=self.maps[index],
+                                   strides=(self._bytesperline(), pixel_size, 1))
+                self.contents[index] = (self.produced, self.rect)
+                frame[:] = self.picture(index)
+                self.filled.append((index, self.sequence))
+            else:
+                self.skipped += 1
+            self.sequence += 1
+            self.produced += 1
+        return True
+
+    # what buffer `index` was last filled with
+    def picture(self, index):
+        number, (top, bottom, left, right) = self.contents[index]
+        picture = self.pictures[number % len(self.pictures)][top:bottom + 1, left:right + 1]
+        if self.scales:
+            height, width = self._shape()
+            rows = np.linspace(0, bottom - top, height).round().astype(np.intp)
+            cols = np.linspace(0, right - left, width).round().astype(np.intp)
+            picture = picture[rows][:, cols]
+        return picture
+
+    # frames V4L2Capture should have counted as captured so far
+    def captured(self):
+        return self.observable + (self.last - self.first + 1 if self.first is not None else 0)
+
+
+# Reads `frames` frames from a started capture and checks what the driver or
+# the buffer handling here could get wrong: every frame has the negotiated
+# shape (and passes `check_frame`, if given), sequence numbers go up, and
+# every frame captured meanwhile was either consumed or counted as dropped.
+def check_capture(capture, frames, timeout=3, check_frame=None):
+    pixel_size = _PIXEL_SIZES[capture.pixelformat]
+    before = capture.stats()
+    read = 0
+    shapes = sequences = contents = True
+    last = None
+    for _ in range(frames):
+        ret, frame = capture.read(timeout)
+        if not ret:
+            break
+        read += 1
+        shapes &= frame.shape == (capture.height, capture.width, pixel_size)
+        sequences &= last is None or capture.seq > last
+        last = capture.seq
+        if check_frame is not None:
+            contents &= bool(check_frame(frame))
+    capture.done()
+    counts = {name: count - before[name] for name, count in capture.stats().items()}
+    counters = counts["consumed"] == read and counts["consumed"] + counts["dropped"] == counts["captured"]
+    return {"frames": read, "shape": [capture.height, capture.width, pixel_size], **counts,
+            "shapes_ok": shapes, "sequence_ok": sequences, "contents_ok": contents, "counters_ok": counters,
+            "ok": read == frames and shapes and sequences and contents and counters}
+
+def print_check(name, result):
+    failed = [check[:-3] for check in ("shapes_ok", "sequence_ok", "contents_ok", "counters_ok") if not result[check]]
+    print(f"{name}: {result['frames']} frames of {'x'.join(map(str, result['shape']))}, captured {result['captured']}, "
+          f"consumed {result['consumed']}, dropped {result['dropped']} "
+          f"{'PASS' if result['ok'] else 'FAIL' + (' (' + ', '.join(failed) + ')' if failed else '')}")
+
+
+# Checks a real device, e.g. v4l2loopback fed by
+#   ffmpeg -re -f lavfi -i testsrc=size=1280x720:rate=60 -pix_fmt bgr24 -f v4l2 /dev/video10
+#   python3 video_backlight/v4l2capture.py /dev/video10 --crop 90 629 160 1119
+if __name__ == "__main__":
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description="Stream from a V4L2 capture device and check its frames and counters")
+    parser.add_argument("device", nargs="?", default="/dev/video0")
+    parser.add_argument("--frames", type=int, default=300, help="frames to read, per crop")
+    parser.add_argument("--size", help="frame size to ask for, WIDTHxHEIGHT")
+    parser.add_argument("--yuyv", action="store_true", help="capture YUYV instead of BGR24")
+    parser.add_argument("--crop", type=int, nargs=4, metavar=("TOP", "BOTTOM", "LEFT", "RIGHT"),
+                        help="also check capturing only this part of the frame, and back")
+    args = parser.parse_args()
+
+    width, height = (int(n) for n in args.size.split("x")) if args.size else (None, None)
+    cap = V4L2Capture(args.device, width, height, PIX_FMT_YUYV if args.yuyv else PIX_FMT_BGR24)
+    if not cap.is_opened():
+        sys.exit(1)
+    cap.start()
+    results = {"full frame": check_capture(cap, args.frames)}
+    if args.crop:
+        cropped = cap.set_crop(args.crop)
+        print(f"crop to {args.crop}: {'granted ' + str(cap.crop) if cropped else 'not supported, full frames'}")
+        results["cropped"] = check_capture(cap, args.frames)
+        cap.set_crop(None)
+        results["full frame again"] = check_capture(cap, args.frames)
+    cap.release()
+    for name, result in results.items():
+        print_check(name, result)
+    if not all(result["ok"] for result in results.values()):
+        sys.exit(1)
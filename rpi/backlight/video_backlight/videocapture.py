@@ -1,15 +1,68 @@
-import cv2
-import queue
+import time
 import threading
 
+
+# Single-slot exchange between a producer thread and one consumer. Each `put`
+# overwrites the slot and bumps the sequence number; `get` waits (on a condition
+# variable, no polling) for a sequence newer than the last one the consumer
+# saw, so it never hands out the same frame twice. Frames that get overwritten
+# before anyone took them are counted as dropped.
+class FrameSlot:
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.item = None
+        self.seq = 0
+        self.captured = 0
+        self.consumed = 0
+        self.dropped = 0
+
+    def put(self, item):
+        with self.cond:
+            if self.item is not None:
+                self.dropped += 1
+            self.item = item
+            self.seq += 1
+            self.captured += 1
+            self.cond.notify_all()
+
+    # returns (seq, item), or (after, None) if nothing newer arrived in time
+    def get(self, after, timeout=None):
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.seq > after, timeout):
+                return after, None
+            item = self.item
+            if item is not None:
+                self.item = None
+                self.consumed += 1
+            return self.seq, item
+
+    def stats(self):
+        with self.cond:
+            return {"captured": self.captured, "consumed": self.consumed, "dropped": self.dropped}
+
+
 class BufferlessVideoCapture:
 
-    def __init__(self, name):
+    # yuyv asks for raw YUYV frames, (height, width, 2), instead of letting
+    # OpenCV convert every frame to bgr
+    def __init__(self, name, yuyv=False):
+        import cv2
         self.cap = cv2.VideoCapture(name)
-        self.q = queue.Queue()
+        self.yuyv = yuyv
+        if yuyv:
+            self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"YUYV"))
+            self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+            self.shape = (int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), 2)
+        self.slot = FrameSlot()
+        # sequence number of the last frame returned by read
+        self.seq = 0
         self.t = threading.Thread(target=self._reader)
         self.t.daemon = True
 
+    def is_opened(self):
+        return self.cap.isOpened() and self.cap.grab()
+
     def start(self):
         self.t.start()
 
@@ -20,18 +73,43 @@ class BufferlessVideoCapture:
                 print("Exiting video capture loop")
                 break
             ret, frame = self.cap.read()
-            if not self.q.empty():
-                try:
-                    self.q.get_nowait()   # discard previous (unprocessed) frame
-                except queue.Empty:
-                    pass
-            self.q.put((ret, frame))
+            self.slot.put((ret, frame))
             if not ret:
                 print("Exiting video capture loop")
                 break
 
-    def read(self):
-        try:
-            return self.q.get(timeout=3)
-        except queue.Empty:
+    # blocks until a frame newer than the previous one is available
+    def read(self, timeout=3):
+        seq, item = self.slot.get(self.seq, timeout)
+        if item is None:
             return False, None
+        self.seq = seq
+        ret, frame = item
+        if self.yuyv and ret and frame.ndim == 2:
+            # older OpenCV hands out the raw buffer as a single row
+            frame = frame.reshape(self.shape)
+        return ret, frame
+
+    # frames are private copies, nothing to hand back
+    def done(self):
+        pass
+
+    def stats(self):
+        return self.slot.stats()
+
+    # OpenCV has no way to crop in the driver, see roi.py
+    def set_crop(self, rect):
+        return False
+
+    # OpenCV can't tell, assume what its own YUYV conversion assumes
+    def yuv_encoding(self):
+        return "bt601", False
+
+    def release(self):
+        cap = self.cap
+        if cap is None:
+            return
+        # stop the reader thread before releasing the device under it
+        self.cap = None
+        time.sleep(1)
+        cap.release()
@@ -0,0 +1,199 @@
+import queue
+import signal
+import threading
+import time
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+# bytes per frame slot unless the first frame is bigger, enough for 1080p bgr
+SLOT_BYTES = 1920 * 1080 * 3
+
+
+# Frame slots, and the colors analyzed from each, in one shared memory block.
+# Frames reach the analysis processes through it without being pickled; only
+# slot numbers and a few scalars go through the queues.
+class FrameRing:
+
+    def __init__(self, slots, slot_bytes, count, name=None):
+        size = slots * (slot_bytes + count * 3)
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.owner = name is None
+        self.name = self.shm.name
+        self.slot_bytes = slot_bytes
+        self.buffers = np.ndarray((slots, slot_bytes), dtype=np.uint8, buffer=self.shm.buf)
+        self.colors = np.ndarray((slots, count, 3), dtype=np.uint8, buffer=self.shm.buf, offset=slots * slot_bytes)
+
+    # the frame in `slot`, viewed as `shape`
+    def frame(self, slot, shape):
+        return self.buffers[slot, :int(np.prod(shape))].reshape(shape)
+
+    def close(self):
+        # views must be dropped before the mapping can be closed
+        self.buffers = self.colors = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _analyze(name, slots, slot_bytes, analyzer, jobs, results):
+    # ctrl+c reaches the whole process group, shutting down is up to the owner
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    ring = FrameRing(slots, slot_bytes, analyzer.sampler.count, name)
+    settings = None
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        slot, seq, shape, brightness, level = job
+        if level != settings:
+            analyzer.configure(*level)
+            settings = level
+        colors = analyzer.analyze(ring.frame(slot, shape), brightness)
+        if colors is not None:
+            ring.colors[slot] = colors
+        # other workers' results may have been shown since, so unchanged
+        # colors are for the owner to skip, not this worker
+        analyzer.shown_colors = None
+        # a copy, the queue pickles it later in its feeder thread
+        results.put((slot, seq, colors is not None, analyzer.skipped, dict(analyzer.timings), analyzer.score, analyzer.cut))
+
+
+# Runs copies of a FrameAnalyzer (sent to each worker as it was configured,
+# before its first frame) in worker processes on frames copied into a FrameRing.
+# Every slot has exactly one owner at a time: free (the pool) -> `acquire`d
+# and filled by the capture loop -> `submit`ted to whichever worker takes the
+# job -> result posted back -> `release`d by the result consumer once it is
+# done with the colors. A slot is never reused before that, and when all
+# of them are in flight `acquire` comes back empty instead of waiting.
+#
+# Each worker keeps its own analyzer, so with more than one the bounds,
+# static and smoothing state is per worker.
+class AnalysisPool:
+
+    def __init__(self, analyzer, workers=1, slots=None, slot_bytes=SLOT_BYTES):
+        # spawn, not fork: the capture, http and output threads must not be
+        # cloned mid-flight into the workers
+        context = multiprocessing.get_context("spawn")
+        self.slots = slots or workers + 2
+        self.count = analyzer.sampler.count
+        self.ring = FrameRing(self.slots, slot_bytes, self.count)
+        self.free = queue.SimpleQueue()
+        for slot in range(self.slots):
+            self.free.put(slot)
+        self.jobs = context.Queue()
+        self.results = context.Queue()
+        self.processes = [context.Process(target=_analyze, args=(self.ring.name, self.slots, slot_bytes, analyzer, self.jobs, self.results),
+                                          daemon=True) for _ in range(workers)]
+        self.seq = 0
+        self.full = 0
+        self.copy = 0
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    # a free slot, or None if every slot is in flight
+    def acquire(self, block=False):
+        try:
+            return self.free.get(block)
+        except queue.Empty:
+            self.full += 1
+            return None
+
+    def submit(self, slot, frame, brightness, level):
+        if frame.nbytes > self.ring.slot_bytes:
+            self.free.put(slot)
+            raise ValueError(f"frame of {frame.shape} doesn't fit a {self.ring.slot_bytes} byte slot")
+        start = time.perf_counter()
+        np.copyto(self.ring.frame(slot, frame.shape), frame)
+        self.copy += time.perf_counter() - start
+        self.seq += 1
+        self.jobs.put((slot, self.seq, frame.shape, brightness, level))
+
+    # (slot, seq, analyzed, skipped, timings, score, cut) of a finished job, or None
+    def get(self, timeout=None):
+        try:
+            return self.results.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def release(self, slot):
+        self.free.put(slot)
+
+    def stop(self):
+        for _ in self.processes:
+            self.jobs.put(None)
+        for process in self.processes:
+            process.join(3)
+            if process.is_alive():
+                process.terminate()
+        self.jobs.close()
+        self.results.close()
+        self.ring.close()
+
+
+# The result consumer and led owner of an AnalysisPool: a thread that shows
+# the colors of finished jobs (results older than what's already shown are
+# dropped, unchanged ones skipped) and hands their slots back. With an
+# OutputClock the colors go to the clock, which does the led io instead.
+# `on_result(skipped, timings, score, cut)` is called for every job, with
+# skipped the counter name of why nothing was shown, or None.
+class PoolOutput:
+
+    def __init__(self, pool, leds, counters, on_result, led_io=None, clock=None):
+        self.pool = pool
+        self.leds = leds
+        self.clock = clock
+        self.counters = counters
+        self.on_result = on_result
+        self.led_io = led_io
+        self.shown_seq = 0
+        self.shown_colors = None
+        self.shown_brightness = None
+        self.running = False
+        self.t = threading.Thread(target=self._collect)
+        self.t.daemon = True
+
+    def start(self):
+        self.running = True
+        self.t.start()
+
+    def stop(self):
+        self.running = False
+        self.t.join()
+
+    def _collect(self):
+        while self.running:
+            result = self.pool.get(timeout=0.1)
+            if result is None:
+                continue
+            slot, seq, analyzed, skipped, timings, score, cut = result
+            if analyzed:
+                skipped = self._show(seq, self.pool.ring.colors[slot], cut)
+            self.pool.release(slot)
+            self.on_result(skipped, timings, score, cut)
+
+    def _show(self, seq, colors, cut):
+        if seq < self.shown_seq:
+            return "late results"
+        if self.clock is not None:
+            self.clock.show(colors, cut)
+            self.shown_seq = seq
+            return None
+        brightness = self.leds.get_brightness()
+        if brightness == self.shown_brightness and np.array_equal(colors, self.shown_colors):
+            return "led writes skipped"
+        start = time.perf_counter()
+        self.leds.show(colors)
+        seconds = time.perf_counter() - start
+        self.counters["led io"] += seconds
+        if self.led_io is not None:
+            self.led_io.observe(seconds)
+        self.shown_seq = seq
+        self.shown_colors = colors.copy()
+        self.shown_brightness = brightness
+        return None
@@ -0,0 +1,98 @@
+import numpy as np
+from .bounds import BLACK_THRESHOLD
+
+# Analysis straight on packed YUYV (4:2:2) frames: Y0 U Y1 V for every two
+# pixels. Only the handful of averaged colors get converted to BGR, instead
+# of every pixel of every frame, and each pixel is 2 bytes instead of 3.
+
+# (Kr, Kb) luma coefficients of each YCbCr encoding
+ENCODINGS = {
+    "bt601": (0.299, 0.114),
+    "bt709": (0.2126, 0.0722),
+}
+
+
+def _matrices(encoding, full_range):
+    kr, kb = ENCODINGS[encoding]
+    kg = 1 - kr - kb
+    if full_range:
+        y_scale, c_scale, y_black = 1, 1, 0
+    else:
+        # limited ("tv") range: luma 16-235, chroma 16-240
+        y_scale, c_scale, y_black = 255 / 219, 255 / 224, 16
+    # bgr from (y - y_black, u - 128, v - 128)
+    to_bgr = np.array([
+        [y_scale, c_scale * 2 * (1 - kb), 0],
+        [y_scale, -c_scale * 2 * kb * (1 - kb) / kg, -c_scale * 2 * kr * (1 - kr) / kg],
+        [y_scale, 0, c_scale * 2 * (1 - kr)],
+    ], dtype=np.float32)
+    offset = np.array([y_black, 128, 128], dtype=np.float32)
+    return to_bgr, offset
+
+# view of a (h, w, 2) YUYV frame as (h, w / 2, 4) macropixels: Y0 U Y1 V
+def macropixels(frame):
+    height, width = frame.shape[:2]
+    row_stride, pixel_stride, byte_stride = frame.strides
+    return np.lib.stride_tricks.as_strided(frame, (height, width // 2, 4), (row_stride, 2 * pixel_stride, byte_stride),
+                                           writeable=False)
+
+# crop to bounds without splitting a macropixel
+def apply_bounds(frame, bounds):
+    return frame[bounds[0]:bounds[1]+1, bounds[2] & ~1:(bounds[3] | 1) + 1]
+
+def bgr_to_yuyv(frame, encoding="bt601", full_range=False):
+    # reference encoder, for the benchmark and for checking against the bgr path
+    to_bgr, offset = _matrices(encoding, full_range)
+    yuv = frame.astype(np.float32) @ np.linalg.inv(to_bgr).T + offset
+    height, width = frame.shape[:2]
+    yuyv = np.empty((height, width // 2 * 2, 2), dtype=np.float32)
+    yuyv[:, :, 0] = yuv[:, :width // 2 * 2, 0]
+    # chroma is shared by each pair of pixels
+    chroma = (yuv[:, 0:width - 1:2, 1:] + yuv[:, 1:width:2, 1:]) / 2
+    yuyv[:, 0::2, 1] = chroma[:, :, 0]
+    yuyv[:, 1::2, 1] = chroma[:, :, 1]
+    return np.clip(np.rint(yuyv), 0, 255).astype(np.uint8)
+
+def yuyv_to_bgr(frame, encoding="bt601", full_range=False):
+    # reference full frame decode, what the bgr path gets from the capture
+    to_bgr, offset = _matrices(encoding, full_range)
+    pixels = macropixels(frame).astype(np.float32)
+    yuv = np.empty(frame.shape[:2] + (3,), dtype=np.float32)
+    yuv[:, :, 0] = frame[:, :, 0]
+    yuv[:, 0::2, 1:] = yuv[:, 1::2, 1:] = pixels[:, :, 1::2]
+    bgr = (yuv - offset) @ to_bgr.T
+    return np.clip(np.rint(bgr), 0, 255).astype(np.uint8)
+
+
+# Wraps a bgr sampler (ZoneAverager, EdgeSampler) to sample YUYV frames: the
+# sampler averages the macropixels as 4 channel pixels, then the averaged
+# Y0 U Y1 V of each zone is converted to one bgr color. Zone columns are
+# split on macropixels, so they can sit up to a pixel off the bgr split.
+class YUVSampler:
+
+    def __init__(self, sampler, encoding="bt601", full_range=False):
+        self.sampler = sampler
+        self.count = sampler.count
+        self.to_bgr, offset = _matrices(encoding, full_range)
+        # the sampler's means are floored, put them back in the middle
+        self.offset = offset - 0.5
+        # letterbox bars are at black level, not zero, in limited range
+        self.black_threshold = BLACK_THRESHOLD + int(offset[0])
+        self.yuv = None
+
+    def set_stride(self, stride):
+        self.sampler.set_stride(stride)
+
+    def means(self, frame):
+        means = self.sampler.means(macropixels(frame))
+        if self.yuv is None or len(self.yuv) != len(means):
+            self.yuv = np.empty((len(means), 3), dtype=np.float32)
+            self.colors = np.empty((len(means), 3), dtype=np.uint8)
+        yuv = self.yuv
+        np.add(means[:, 0], means[:, 2], out=yuv[:, 0], dtype=np.float32)
+        yuv[:, 0] /= 2
+        yuv[:, 1:] = means[:, 1::2]
+        yuv -= self.offset
+        np.clip(np.rint(yuv @ self.to_bgr.T), 0, 255, out=yuv)
+        self.colors[:] = yuv
+        return self.colors
@@ -0,0 +1,63 @@
+import numpy as np
+
+# fewest rows per zone a row stride may leave, see ZoneAverager
+MIN_SAMPLED_ROWS = 64
+
+def split_edges(length, count):
+    # start offsets of `count` nearly equal parts, matching np.array_split
+    size, extra = divmod(length, count)
+    sizes = np.full(count, size, dtype=np.intp)
+    sizes[:extra] += 1
+    return np.concatenate(([0], np.cumsum(sizes)[:-1])), sizes
+
+
+# Averages a rows x cols grid of zones in a single pass over the frame.
+# Each horizontal band of rows is summed down into a preallocated uint32
+# buffer (a 4k frame split in two rows still fits comfortably), then the much
+# smaller per-band column sums are reduced per zone with np.add.reduceat.
+# Zones are returned row-major: for the default 2x3 grid that's
+# [upper_left, upper_middle, upper_right, lower_left, lower_middle, lower_right]
+#
+# With a stride > 1 only every stride'th row of each zone is summed. Zone
+# boundaries stay where they are at full resolution, so the result only
+# differs from the full average by how well the sampled rows represent the
+# zone, and skipping whole rows keeps every read contiguous. The stride is
+# capped so every zone keeps MIN_SAMPLED_ROWS rows: a horizontal edge
+# crossing a zone then moves its mean by at most 255 / MIN_SAMPLED_ROWS,
+# per edge. Detail finer than the stride isn't bounded: stripes that line up
+# with the sampled rows can move the mean by up to full scale.
+class ZoneAverager:
+    def __init__(self, rows=2, cols=3):
+        self.rows = rows
+        self.cols = cols
+        self.count = rows * cols
+        self.stride = 1
+        self.shape = None
+
+    def set_stride(self, stride):
+        if stride != self.stride:
+            self.stride = stride
+            self.shape = None
+
+    def _prepare(self, shape):
+        self.shape = shape
+        row_edges, row_sizes = split_edges(shape[0], self.rows)
+        stride = max(1, min(self.stride, row_sizes.min() // MIN_SAMPLED_ROWS))
+        self.row_slices = [slice(start, start + size, stride) for start, size in zip(row_edges, row_sizes)]
+        # rows actually summed per zone
+        row_sizes = -(-row_sizes // stride)
+        self.col_edges, col_sizes = split_edges(shape[1], self.cols)
+        counts = np.outer(row_sizes, col_sizes).reshape(-1, 1)
+        self.counts = np.maximum(counts, 1).astype(np.uint32)
+        self.row_sums = np.empty((self.rows,) + tuple(shape[1:]), dtype=np.uint32)
+
+    def sums(self, frame):
+        if frame.shape != self.shape:
+            self._prepare(frame.shape)
+        for i, rows in enumerate(self.row_slices):
+            frame[rows].sum(axis=0, dtype=np.uint32, out=self.row_sums[i])
+        sums = np.add.reduceat(self.row_sums, self.col_edges, axis=1)
+        return sums.reshape(self.count, -1)
+
+    def means(self, frame):
+        return (self.sums(frame) // self.counts).astype(np.uint8)